@@ -1,24 +1,66 @@
+import asyncio
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Query
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Query, Header
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 import os
-import shutil
 import datetime
 import json
-from typing import Optional
+from collections import Counter
+import base64
+import hashlib
+import tempfile
+import numpy as np
+import tarfile
+import zipfile
+from typing import List, Optional
 
 # Import ML and Security modules from their new folder
-from ml_models.database import init_db, insert_document, get_documents_by_role, log_access, register_user, get_document_by_id, delete_document, cleanup_invalid_documents, force_cleanup_all_documents
-from ml_models.document_processor import extract_text, extract_metadata, summarize_text
+from ml_models.database import DATABASE_FILE, init_db, ensure_schema, insert_documents, save_document_content, get_document_content, get_content_hashes, get_documents_by_role, list_documents_page, page_key, log_access, register_user, get_document_by_id, get_documents_by_ids, get_document_contents, get_passages, save_passages, get_document_ids_by_content_hashes, record_uploads, get_document_frequencies, add_document_frequencies, delete_document, cleanup_invalid_documents, force_cleanup_all_documents, get_referenced_filepaths, update_user, search_documents_text
+from ml_models.document_processor import extract_text, extract_metadata_batch, build_term_matrix, summarize_sentences, compute_file_hash
 from ml_models.classification_model import DocumentClassifier
-from ml_models.search_engine import SemanticSearchEngine
-from ml_models.security_manager import SecurityManager
+from ml_models.search_engine import SemanticSearchEngine, normalize_query, reciprocal_rank_fusion
+from ml_models.cache import TTLCache
+from ml_models.access_log import access_log, query_access_logs
+from ml_models.chunking import get_passage
+from ml_models.security_manager import SecurityManager, TOKEN_TTL_SECONDS
+from ml_models.ingestion import IngestionPipeline, SQLiteJobStore, QueueFullError
+from ml_models.model_registry import registry, preload_configured
+from ml_models.model_server import MODEL_SERVER_ADDRESS, ModelServerClient, ModelServerError, RemoteSearchEngine, RemoteClassifier
 
 # --- Initialize Core Components ---
-classifier = DocumentClassifier()
-search_engine = SemanticSearchEngine()
+if MODEL_SERVER_ADDRESS:
+    # Models and the search index live in a shared model server process
+    model_client = ModelServerClient(MODEL_SERVER_ADDRESS)
+    search_engine = RemoteSearchEngine(model_client)
+    classifier = RemoteClassifier(model_client)
+    extract_metadata_batch = model_client.proxy('document_processor').extract_metadata_batch
+else:
+    model_client = None
+    # Models are loaded through the registry on first use, not here
+    search_engine = SemanticSearchEngine(index_dir=os.path.dirname(DATABASE_FILE))
+    # Classifies from the embeddings computed for search, see classify_stage
+    classifier = DocumentClassifier()
 security = SecurityManager()
+startup_complete = False
+
+# Shaped /search/ responses. The index version is part of the key, so any
+# change to the index makes older entries unreachable; the TTL covers
+# metadata changes that do not touch the index.
+SEARCH_TOP_K = 5
+search_cache = TTLCache(maxsize=int(os.environ.get('SEARCH_CACHE_SIZE', 2048)), ttl=60)
+
+# 'semantic' (the default) ranks by embedding similarity, 'keyword' by BM25
+# over the full-text index (no model involved) and 'hybrid' fuses both
+# rankings, so exact identifiers such as invoice numbers are found as well
+SEARCH_MODES = ('semantic', 'hybrid', 'keyword')
+# Candidates taken from each ranking before fusing, and the usual RRF constant
+FUSION_CANDIDATES = 20
+RRF_K = 60
+
+# With `gunicorn --preload` this runs once in the master process
+preload_configured()
 
 # Define the lifespan event handler
 @asynccontextmanager
@@ -26,31 +68,60 @@ async def lifespan(app: FastAPI):
     # This code runs on application startup
     print("Application startup event triggered.")
     
-    # Ensure data directory and database exist
-    if not os.path.exists('data'):
-        os.makedirs('data')
+    # Ensure data directory and database exist; seeding only inserts missing users
+    os.makedirs(os.path.dirname(DATABASE_FILE), exist_ok=True)
+    if not os.path.exists(DATABASE_FILE):
         init_db()
+    ensure_schema()
     
     # Clean up documents with invalid dates
     print("Cleaning up documents with invalid dates...")
-    cleanup_invalid_documents()
+    delete_orphaned_files(path for _, path in cleanup_invalid_documents())
     
-    # Rebuild the FAISS index from the database
-    print("Rebuilding in-memory search index...")
-    all_docs = get_documents_by_role("Admin")
+    # Load the saved FAISS index and only embed documents it does not cover
+    print("Loading search index from disk...")
+    if search_engine.load():
+        print(f"Loaded {len(search_engine.document_ids)} vectors from the saved index.")
+    removed_count = prune_search_index()
+    all_docs = get_documents_by_role("Admin", columns=['filepath', 'category'])
+    content_hashes = get_content_hashes()
+    embedded_count = 0
     for doc in all_docs:
         try:
-            doc_text = extract_text(doc[2])
-            search_engine.add_document(doc[0], doc_text)
+            if search_engine.is_current(doc['id'], content_hashes.get(doc['id'])):
+                search_engine.set_category(doc['id'], doc['category'])
+                continue
+            doc_text, content_hash = load_document_text(doc)
+            search_engine.add_document(doc['id'], doc_text, content_hash=content_hash, category=doc['category'])
+            embedded_count += 1
         except Exception as e:
-            print(f"Error rebuilding index for document ID {doc[0]}: {e}")
+            print(f"Error rebuilding index for document ID {doc['id']}: {e}")
             continue
-    print("Search index rebuilt successfully.")
+    search_engine.save()
+    if model_client is None:
+        # The model server saves its own index
+        search_engine.start_autosave()
+    print(f"Search index ready: embedded {embedded_count}, removed {removed_count} stale documents.")
+    
+    # Learn the classifier's label vectors from documents classified so far
+    doc_ids, doc_vectors = search_engine.document_embeddings()
+    indexed_categories = search_engine.document_categories
+    learned = classifier.fit_head(doc_vectors, [indexed_categories.get(int(doc_id)) for doc_id in doc_ids])
+    if learned:
+        print(f"Classifier uses learned label vectors for: {', '.join(learned)}")
+    
+    # Uploads are processed in the background from here on
+    ingestion.start()
+    global startup_complete
+    startup_complete = True
     
     yield # The application will run here
     
     # This code runs on application shutdown
     print("Application shutdown event triggered.")
+    ingestion.stop()
+    search_engine.save()
+    access_log.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -62,209 +133,726 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+def prune_search_index():
+    """Removes vectors of documents that no longer exist in the database."""
+    remaining_ids = {doc['id'] for doc in get_documents_by_role("Admin", columns=['id'])}
+    stale_ids = search_engine.document_ids - remaining_ids
+    return search_engine.remove_documents(stale_ids)
+
+def load_document_text(doc):
+    """
+    Returns (text, content_hash) for a document row from the content store.
+    Documents uploaded before the store existed are parsed once and backfilled.
+    """
+    content = get_document_content(doc['id'])
+    if content:
+        return content
+    content_hash = compute_file_hash(doc['filepath'])
+    text = extract_text(doc['filepath'])
+    save_document_content(doc['id'], text, content_hash)
+    return text, content_hash
+
+# Category-specific fallback messages and team authors
+CATEGORY_FALLBACKS = {
+    'HR': 'HR-related document',
+    'Finance': 'Finance-related document', 
+    'Legal': 'Legal-related document',
+    'Admin': 'Administrative document'
+}
+
+TEAM_AUTHORS = {
+    'HR': 'hr_team',
+    'Finance': 'finance_team',
+    'Legal': 'legal_team',
+    'Admin': 'admin_team'
+}
+
+def safe_value(value, fallback="No information available"):
+    """Replaces null/empty/placeholder values with a fallback."""
+    if value is None or value == "" or value == "Unknown" or value == "Untitled":
+        return fallback
+    return value
+
+# Response fields of a document and the column each one is built from
+RESPONSE_FIELDS = {
+    'id': 'id',
+    'filename': 'filename',
+    'filepath': 'filepath',
+    'upload_date': 'upload_date',
+    'uploader': 'uploader',
+    'category': 'category',
+    'title': 'title',
+    'summary': 'summary',
+    'author': 'category',
+    'entities': 'entities'
+}
+
+def format_document(doc, role, fields=None):
+    """
+    Shapes a documents row into the response format of the listing and search
+    endpoints. With `fields`, only those response fields are returned and the
+    row only needs their columns.
+    """
+    fields = fields or RESPONSE_FIELDS
+    result = {}
+    
+    for field in fields:
+        value = doc[RESPONSE_FIELDS[field]]
+        if field == 'category':
+            # Get category-specific fallback based on user role
+            value = safe_value(value, CATEGORY_FALLBACKS.get(role, 'General document'))
+        elif field == 'author':
+            # Use team author based on category instead of the extracted author
+            actual_category = value if value and value != "" else role
+            value = TEAM_AUTHORS.get(actual_category, f"{role.lower()}_team")
+        elif field == 'entities':
+            # Parse entities safely
+            entities = {}
+            try:
+                if value and value != "null":
+                    entities = json.loads(value)
+            except (json.JSONDecodeError, TypeError):
+                entities = {}
+            # Older rows list every occurrence; newer ones store counts
+            value = {
+                label: dict(Counter(texts)) if isinstance(texts, list) else texts
+                for label, texts in entities.items()
+            } if isinstance(entities, dict) else {}
+        elif field == 'filename':
+            value = safe_value(value, "Unknown file")
+        elif field == 'uploader':
+            value = safe_value(value, "Unknown user")
+        elif field == 'title':
+            value = safe_value(value, "No title available")
+        elif field == 'summary':
+            value = safe_value(value, "No summary available")
+        result[field] = value
+    
+    return result
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, order_by: str = 'id'):
+    """Decodes a cursor and checks it has the key shape page_key gives for order_by."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if order_by == 'id':
+        valid = isinstance(key, int) and not isinstance(key, bool)
+    else:
+        valid = (isinstance(key, list) and len(key) == 2 and isinstance(key[0], str)
+                 and isinstance(key[1], int) and not isinstance(key[1], bool))
+    if not valid:
+        raise HTTPException(status_code=400, detail=f"Cursor does not match order_by={order_by}")
+    return key
+
+# --- Ingestion Pipeline ---
+# A job carries a list of documents, so every stage can run its model on a
+# whole batch. Single uploads are simply batches of one.
+def extract_stage(ctx):
+    # Files whose content was processed before are linked to that document
+    # instead of going through the models again
+    known = get_document_ids_by_content_hashes([doc['content_hash'] for doc in ctx['documents']])
+    extracted = []
+    seen = set()
+    for doc in ctx['documents']:
+        if doc['content_hash'] in known or doc['content_hash'] in seen:
+            ctx['duplicates'].append(doc)
+            continue
+        try:
+            doc['text'] = extract_text(doc['filepath'])
+            extracted.append(doc)
+            seen.add(doc['content_hash'])
+        except Exception as e:
+            print(f"Error extracting text from {doc['filename']}: {e}")
+            ctx['failed'].append({'filename': doc['filename'], 'error': str(e)})
+    ctx['documents'] = extracted
+    
+    if not extracted:
+        if not ctx['duplicates']:
+            raise RuntimeError(ctx['failed'][0]['error'] if ctx['failed'] else "No documents to process")
+        finish_ingestion(ctx, [])
+        ctx['done'] = True
+
+def metadata_stage(ctx):
+    metadatas = extract_metadata_batch([doc['text'] for doc in ctx['documents']])
+    for doc, metadata in zip(ctx['documents'], metadatas):
+        doc['metadata'] = metadata
+
+def embed_stage(ctx):
+    embeddings = search_engine.embed_documents([doc['text'] for doc in ctx['documents']])
+    for doc, vectors in zip(ctx['documents'], embeddings):
+        doc['embeddings'] = vectors
+
+def classify_stage(ctx):
+    # The mean passage vector stands in for the whole document
+    doc_embeddings = [
+        doc['embeddings'].mean(axis=0) if len(doc['embeddings']) else np.zeros(search_engine.embedding_dim, dtype='float32')
+        for doc in ctx['documents']
+    ]
+    categories = classifier.classify_documents([doc['text'] for doc in ctx['documents']], doc_embeddings)
+    for doc, category in zip(ctx['documents'], categories):
+        doc['category'] = category
+
+def summarize_stage(ctx):
+    matrices = [build_term_matrix(doc['text']) for doc in ctx['documents']]
+    frequencies, corpus_size = get_document_frequencies(set().union(*(terms for _, terms, _ in matrices)))
+    for doc, (sentences, terms, matrix) in zip(ctx['documents'], matrices):
+        doc['summary'] = summarize_sentences(sentences, terms, matrix, frequencies, corpus_size)
+        doc['terms'] = terms
+
+def index_stage(ctx):
+    docs = ctx['documents']
+    docs_data = []
+    for doc in docs:
+        metadata = doc['metadata']
+        docs_data.append({
+            'filename': doc['filename'],
+            'filepath': doc['filepath'],
+            'upload_date': datetime.datetime.now().isoformat(),
+            'uploader': doc['uploader'],
+            'category': doc['category'],
+            'title': metadata['title'],
+            'author': metadata['author'],
+            'date_extracted': metadata['date_extracted'],
+            'summary': doc['summary'],
+            'entities': metadata['entities']
+        })
+    
+    # Metadata and extracted text of the whole batch go in one transaction. Content
+    # that another job stored since extract_stage checked is skipped and linked instead.
+    doc_ids = insert_documents(docs_data, [(doc['text'], doc['content_hash']) for doc in docs])
+    processed = [(doc_id, doc) for doc_id, doc in zip(doc_ids, docs) if doc_id is not None]
+    ctx['duplicates'].extend(doc for doc_id, doc in zip(doc_ids, docs) if doc_id is None)
+    if processed:
+        search_engine.add_documents([
+            (doc_id, doc['text'], doc['content_hash'], doc['category'])
+            for doc_id, doc in processed
+        ], embeddings=[doc['embeddings'] for _, doc in processed])
+        add_document_frequencies(Counter(term for _, doc in processed for term in doc['terms']), len(processed))
+    finish_ingestion(ctx, processed)
+
+def finish_ingestion(ctx, processed):
+    """
+    Records the uploads of a job, newly processed and linked duplicates alike,
+    and sets the job result.
+    
+    Args:
+        processed: (doc_id, doc) pairs of the documents inserted by this job.
+    """
+    doc_ids = {doc['content_hash']: doc_id for doc_id, doc in processed}
+    doc_ids.update(get_document_ids_by_content_hashes(
+        [doc['content_hash'] for doc in ctx['duplicates'] if doc['content_hash'] not in doc_ids]
+    ))
+    linked = [(doc_ids[doc['content_hash']], doc) for doc in ctx['duplicates'] if doc['content_hash'] in doc_ids]
+    
+    existing = {}
+    if linked:
+        columns = ['filepath', 'category', 'title', 'author', 'date_extracted', 'entities']
+        existing = {row['id']: row for row in get_documents_by_ids([doc_id for doc_id, _ in linked], columns=columns)}
+        for doc_id, doc in linked:
+            # Same content saved under another extension is not needed twice
+            if doc_id in existing and doc['filepath'] != existing[doc_id]['filepath'] and os.path.exists(doc['filepath']):
+                os.remove(doc['filepath'])
+    
+    upload_date = datetime.datetime.now().isoformat()
+    record_uploads([(doc_id, doc['uploader'], doc['filename'], upload_date) for doc_id, doc in processed + linked])
+    for doc_id, doc in processed + linked:
+        log_access(doc['uploader'], 'upload', doc_id)
+    
+    documents = []
+    for doc_id, doc in processed:
+        documents.append({"doc_id": doc_id, "filename": doc['filename'], "classification": doc['category'],
+                          "metadata": doc['metadata'], "duplicate": False})
+    for doc_id, doc in linked:
+        row = existing.get(doc_id)
+        metadata = {
+            'title': row['title'],
+            'author': row['author'],
+            'date_extracted': row['date_extracted'],
+            'entities': json.loads(row['entities']) if row['entities'] else {}
+        } if row else {}
+        documents.append({"doc_id": doc_id, "filename": doc['filename'], "classification": row['category'] if row else None,
+                          "metadata": metadata, "duplicate": True})
+    
+    if not ctx['batch']:
+        document = documents[0]
+        ctx['result'] = {
+            "message": "Identical document already exists; linked this upload to it" if document['duplicate']
+                       else "Document uploaded and processed successfully",
+            "doc_id": document['doc_id'],
+            "classification": document['classification'],
+            "metadata": document['metadata'],
+            "duplicate": document['duplicate']
+        }
+    else:
+        ctx['result'] = {
+            "message": f"Processed {len(processed)} documents, linked {len(linked)} duplicates",
+            "documents": [
+                {key: document[key] for key in ('doc_id', 'filename', 'classification', 'duplicate')}
+                for document in documents
+            ],
+            "failed": ctx['failed']
+        }
+
+# The model stages get one worker each: they are CPU bound and share one model instance
+ingestion = IngestionPipeline([
+    ('extract', extract_stage, 2),
+    ('metadata', metadata_stage, 1),
+    ('embed', embed_stage, 1),
+    ('classify', classify_stage, 1),
+    ('summarize', summarize_stage, 1),
+    ('index', index_stage, 1)
+], queue_size=32, job_store=SQLiteJobStore())  # any worker can answer /jobs/{id}
+
 # --- Security Dependencies ---
-def get_user_from_form(username: str = Form(...), password: str = Form(...)):
-    user = security.authenticate(username, password)
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    return user
+def resolve_user(token, authorization, username, password):
+    """
+    Authenticates a request by signed token (form/query field or Bearer header),
+    falling back to the legacy username/password pair.
+    """
+    if authorization and authorization.lower().startswith('bearer '):
+        token = authorization[len('bearer '):]
+    if token:
+        user = security.verify_token(token)
+        if not user:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+        return user
 
-def get_user_from_query(username: str = Query(...), password: str = Query(...)):
-    user = security.authenticate(username, password)
+    user = security.authenticate(username, password) if username and password else None
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     return user
 
+def get_user_from_form(
+    username: Optional[str] = Form(None),
+    password: Optional[str] = Form(None),
+    token: Optional[str] = Form(None),
+    authorization: Optional[str] = Header(None)
+):
+    return resolve_user(token, authorization, username, password)
+
+def get_user_from_query(
+    username: Optional[str] = Query(None),
+    password: Optional[str] = Query(None),
+    token: Optional[str] = Query(None),
+    authorization: Optional[str] = Header(None)
+):
+    return resolve_user(token, authorization, username, password)
+
 # --- API Endpoints ---
 
 @app.get("/")
 def read_root():
     return {"message": "Document Classification API is running!"}
 
-@app.post("/upload/")
-async def upload_document(
+@app.get("/ready")
+def readiness():
+    """
+    Reports whether startup has finished and which models are loaded.
+    
+    Models load on first use, so a ready worker can still have cold models;
+    `models` shows which ones are warm.
+    """
+    if model_client is None:
+        status = {"ready": startup_complete, "models": registry.status()}
+    else:
+        try:
+            status = {"ready": startup_complete, "models": model_client.call('registry', 'status')}
+        except ModelServerError as e:
+            status = {"ready": False, "models": {}, "error": str(e)}
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.post("/login/")
+def login(username: str = Form(...), password: str = Form(...)):
+    """Exchanges a username and password for a signed, expiring access token."""
+    user = security.authenticate(username, password)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    return JSONResponse(content={
+        "access_token": security.create_token(user),
+        "token_type": "bearer",
+        "expires_in": TOKEN_TTL_SECONDS,
+        "role": user['role']
+    })
+
+@app.post("/upload/", status_code=202)
+def upload_document(
     file: UploadFile = File(...),
     current_user: dict = Depends(get_user_from_form)
 ):
     """
-    Uploads a document, processes it, and stores metadata in the DB.
+    Stores an uploaded document and queues it for processing.
+    
+    Returns a job id right away; poll /jobs/{job_id} for progress and the
+    classification result.
     """
-    file_path = f"data/{file.filename}"
+    file_path, content_hash, created = store_upload(file.filename, file.file)
     
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    text = extract_text(file_path)
-    metadata = extract_metadata(text)
-    category = classifier.classify_document(text)
-    summary = summarize_text(text)
-    
-    doc_data = {
-        'filename': file.filename,
-        'filepath': file_path,
-        'upload_date': datetime.datetime.now().isoformat(),
-        'uploader': current_user['username'],
-        'category': category,
-        'title': metadata['title'],
-        'author': metadata['author'],
-        'date_extracted': metadata['date_extracted'],
-        'summary': summary,
-        'entities': metadata['entities']
-    }
-    
-    doc_id = insert_document(doc_data)
-    search_engine.add_document(doc_id, text)
-    log_access(current_user['username'], 'upload', doc_id)
+    try:
+        job_id = ingestion.submit({
+            'documents': [{
+                'filename': file.filename,
+                'filepath': file_path,
+                'content_hash': content_hash,
+                'uploader': current_user['username']
+            }],
+            'batch': False,
+            'failed': [],
+            'duplicates': []
+        }, owner=current_user['username'])
+    except QueueFullError as e:
+        if created:
+            os.remove(file_path)
+        raise HTTPException(status_code=503, detail=str(e))
     
-    return JSONResponse(content={
-        "message": "Document uploaded and processed successfully",
-        "doc_id": doc_id,
-        "classification": category,
-        "metadata": metadata
+    return JSONResponse(status_code=202, content={
+        "message": "Document uploaded and queued for processing",
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}"
     })
 
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.txt')
+BATCH_JOB_SIZE = 32
+
+BLOB_DIR = 'data/blobs'
+
+def store_upload(name, source):
+    """
+    Streams an uploaded or unpacked file into the content-addressed blob
+    store, hashing it on the way.
+    
+    Returns (filepath, content_hash, created), where created is False when an
+    identical file was already stored.
+    """
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    sha = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=BLOB_DIR, suffix='.part')
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            for block in iter(lambda: source.read(1024 * 1024), b''):
+                sha.update(block)
+                buffer.write(block)
+        content_hash = sha.hexdigest()
+        # The extension stays, extraction picks the parser by it
+        file_path = f"{BLOB_DIR}/{content_hash}{os.path.splitext(name)[1].lower()}"
+        if os.path.exists(file_path):
+            os.remove(tmp_path)
+            return file_path, content_hash, False
+        os.replace(tmp_path, file_path)
+        return file_path, content_hash, True
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# Blobs no document points to are only swept once they are this old, so
+# files of uploads still waiting in the ingestion queue are left alone
+ORPHAN_BLOB_MIN_AGE_SECONDS = 24 * 3600
+
+def delete_orphaned_files(filepaths):
+    """Deletes those of the given files that no remaining document points to."""
+    filepaths = set(filepaths)
+    removed = 0
+    for path in filepaths - get_referenced_filepaths(filepaths):
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Warning: Could not delete file {path}: {e}")
+    return removed
+
+def sweep_orphan_blobs():
+    """Deletes stored blobs that no document points to, e.g. left by failed uploads."""
+    if not os.path.isdir(BLOB_DIR):
+        return 0
+    cutoff = datetime.datetime.now().timestamp() - ORPHAN_BLOB_MIN_AGE_SECONDS
+    candidates = []
+    with os.scandir(BLOB_DIR) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                candidates.append(f"{BLOB_DIR}/{entry.name}")
+    return delete_orphaned_files(candidates)
+
+def remove_deleted_documents(deleted):
+    """
+    Brings the search index and the file store in line after documents were
+    deleted from the database. deleted holds (id, filepath) pairs.
+    """
+    removed = search_engine.remove_documents([doc_id for doc_id, _ in deleted])
+    files = delete_orphaned_files(path for _, path in deleted) + sweep_orphan_blobs()
+    print(f"Removed {removed} documents from the search index and {files} files after cleanup")
+
+def unpack_upload(file: UploadFile):
+    """
+    Yields (filename, filepath, content_hash, created) for an uploaded document
+    or every document inside an uploaded zip/tar archive.
+    """
+    name = file.filename.lower()
+    if name.endswith('.zip'):
+        with zipfile.ZipFile(file.file) as archive:
+            for member in archive.infolist():
+                if not member.is_dir() and member.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                    with archive.open(member) as source:
+                        yield (os.path.basename(member.filename),) + store_upload(member.filename, source)
+    elif name.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2')):
+        with tarfile.open(fileobj=file.file, mode='r:*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    yield (os.path.basename(member.name),) + store_upload(member.name, archive.extractfile(member))
+    elif name.endswith(SUPPORTED_EXTENSIONS):
+        yield (file.filename,) + store_upload(file.filename, file.file)
+
+@app.post("/upload/batch/", status_code=202)
+def upload_documents(
+    files: List[UploadFile] = File(...),
+    current_user: dict = Depends(get_user_from_form)
+):
+    """
+    Uploads many documents at once, as separate files and/or zip/tar archives.
+    
+    Documents are queued in jobs of up to BATCH_JOB_SIZE, and each job runs
+    NER, classification and embedding on its documents as model batches.
+    """
+    documents = []
+    for file in files:
+        try:
+            for filename, file_path, content_hash, created in unpack_upload(file):
+                documents.append({'filename': filename, 'filepath': file_path, 'content_hash': content_hash,
+                                  'created': created, 'uploader': current_user['username']})
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            raise HTTPException(status_code=400, detail=f"Could not read archive {file.filename}: {e}")
+    if not documents:
+        raise HTTPException(status_code=400, detail="No PDF, DOCX or TXT documents found in the upload")
+    
+    job_ids = []
+    queued = 0
+    for start in range(0, len(documents), BATCH_JOB_SIZE):
+        batch = documents[start:start + BATCH_JOB_SIZE]
+        try:
+            job_ids.append(ingestion.submit({'documents': batch, 'batch': True, 'failed': [], 'duplicates': []},
+                                            owner=current_user['username']))
+            queued += len(batch)
+        except QueueFullError as e:
+            # Files that did not make it into a job are not kept
+            for doc in documents[start:]:
+                if doc['created'] and os.path.exists(doc['filepath']):
+                    os.remove(doc['filepath'])
+            if not job_ids:
+                raise HTTPException(status_code=503, detail=str(e))
+            break
+    
+    return JSONResponse(status_code=202, content={
+        "message": f"Queued {queued} of {len(documents)} documents for processing",
+        "job_ids": job_ids,
+        "status_urls": [f"/jobs/{job_id}" for job_id in job_ids]
+    })
+
+# Plain def endpoints: FastAPI runs them in its threadpool, so their SQLite
+# queries do not block the event loop
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: str, current_user: dict = Depends(get_user_from_query)):
+    """Reports the progress of an upload job and, once completed, its result."""
+    job = ingestion.get_job(job_id)
+    if not job or (current_user['role'] != 'Admin' and job['owner'] != current_user['username']):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(content=job)
+
 @app.get("/documents/")
-async def get_documents(current_user: dict = Depends(get_user_from_query)):
+def get_documents(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    order_by: str = Query('id', regex='^(id|upload_date)$'),
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_user_from_query)
+):
     """
-    Retrieves a list of documents based on the user's role.
+    Retrieves one page of documents based on the user's role, newest first.
+    
+    Pass the X-Next-Cursor response header back as `cursor` to get the next
+    page; it is absent on the last page. `fields` is an optional
+    comma-separated list of response fields, e.g. to skip entities and summary.
     """
-    documents = get_documents_by_role(current_user['role'])
+    requested = [field.strip() for field in fields.split(',') if field.strip()] if fields else list(RESPONSE_FIELDS)
+    unknown = [field for field in requested if field not in RESPONSE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    columns = {RESPONSE_FIELDS[field] for field in requested}
     
-    # Category-specific fallback messages and team authors
-    category_fallbacks = {
-        'HR': 'HR-related document',
-        'Finance': 'Finance-related document', 
-        'Legal': 'Legal-related document',
-        'Admin': 'Administrative document'
-    }
+    after = decode_cursor(cursor, order_by) if cursor else None
+    # Fetch one extra row to know whether there is a next page
+    documents = list_documents_page(current_user['role'], limit + 1, after, order_by, columns)
+    has_more = len(documents) > limit
+    documents = documents[:limit]
     
-    team_authors = {
-        'HR': 'hr_team',
-        'Finance': 'finance_team',
-        'Legal': 'legal_team',
-        'Admin': 'admin_team'
-    }
+    result = [format_document(doc, current_user['role'], requested) for doc in documents]
     
-    result = []
-    for doc in documents:
-        # Helper function to handle null/empty values
-        def safe_value(value, fallback="No information available"):
-            if value is None or value == "" or value == "Unknown" or value == "Untitled":
-                return fallback
-            return value
-        
-        # Get category-specific fallback based on user role
-        category_fallback = category_fallbacks.get(current_user['role'], 'General document')
-        
-        # Get team author based on category
-        actual_category = doc[5] if doc[5] and doc[5] != "" else current_user['role']
-        team_author = team_authors.get(actual_category, f"{current_user['role'].lower()}_team")
-        
-        # Parse entities safely
-        entities = {}
-        try:
-            if doc[10] and doc[10] != "null":
-                entities = json.loads(doc[10])
-        except (json.JSONDecodeError, TypeError):
-            entities = {}
-        
-        result.append({
-            'id': doc[0],
-            'filename': safe_value(doc[1], "Unknown file"),
-            'filepath': doc[2],
-            'upload_date': doc[3],
-            'uploader': safe_value(doc[4], "Unknown user"),
-            'category': safe_value(doc[5], category_fallback),
-            'title': safe_value(doc[6], "No title available"),
-            'summary': safe_value(doc[9], "No summary available"),
-            'author': team_author,
-            'entities': entities if entities else {}
-        })
+    headers = {}
+    if has_more:
+        headers['X-Next-Cursor'] = encode_cursor(page_key(documents[-1], order_by))
     
     log_access(current_user['username'], 'view_list')
-    return JSONResponse(content=result)
+    return JSONResponse(content=result, headers=headers)
+
+def fetch_hits(scores, role):
+    """
+    Returns the hit documents the role may see and their passages, see
+    hit_passages. Runs the database queries of a search in one threadpool call.
+    """
+    documents = [doc for doc in get_documents_by_ids(scores) if security.has_access(role, doc['category'])]
+    passages = hit_passages(
+        (doc['id'], scores[doc['id']]['chunk_no']) for doc in documents
+        if scores[doc['id']]['chunk_no'] is not None
+    )
+    return documents, passages
+
+def hit_passages(keys):
+    """Returns {(document_id, chunk_no): passage text} for search hits."""
+    keys = list(keys)
+    passages = get_passages(keys)
+    passages.update(backfill_passages(key for key in keys if key not in passages))
+    return passages
+
+def backfill_passages(keys):
+    """
+    Finds passages of documents indexed before passages were stored by
+    chunking their text once, and stores all their passages for next time.
+    """
+    keys = list(keys)
+    passages = {}
+    for doc_id, text in get_document_contents({doc_id for doc_id, _ in keys}).items():
+        save_passages(doc_id, text)
+        for key_doc_id, chunk_no in keys:
+            if key_doc_id == doc_id:
+                passages[(doc_id, chunk_no)] = get_passage(text, chunk_no)
+    return passages
+
+async def ranked_hits(query: str, mode: str, categories):
+    """
+    Runs the searches of a mode, restricted to the given categories.
+
+    Returns hits best first, each with the document id, its score and either
+    the chunk number of the best passage or a keyword snippet. Every search
+    runs in the threadpool, so encoding and SQLite never block the event loop.
+    """
+    if mode == 'semantic':
+        return await run_in_threadpool(search_engine.search, query, SEARCH_TOP_K, categories)
+    if mode == 'keyword':
+        semantic, keyword = [], await run_in_threadpool(search_documents_text, query, categories, SEARCH_TOP_K)
+    else:
+        # The embedding search and the BM25 lookup run at the same time
+        semantic, keyword = await asyncio.gather(
+            run_in_threadpool(search_engine.search, query, FUSION_CANDIDATES, categories),
+            run_in_threadpool(search_documents_text, query, categories, FUSION_CANDIDATES)
+        )
+
+    chunks = {result['document_id']: result['chunk_no'] for result in semantic}
+    snippets = dict(keyword)
+    rankings = [ranking for ranking in ([r['document_id'] for r in semantic], [doc_id for doc_id, _ in keyword]) if ranking]
+    return [
+        {'document_id': doc_id, 'score': score, 'chunk_no': chunks.get(doc_id), 'snippet': snippets.get(doc_id)}
+        for doc_id, score in reciprocal_rank_fusion(rankings, k=RRF_K)[:SEARCH_TOP_K]
+    ]
 
 @app.get("/search/")
 async def semantic_search(
     query: str,
+    mode: str = Query('semantic'),
     current_user: dict = Depends(get_user_from_query)
 ):
     """
-    Performs a semantic search and returns relevant documents with full details.
+    Searches documents and returns relevant ones with full details.
+
+    mode is 'semantic' (scores are cosine similarities), 'keyword' or
+    'hybrid' (both rankings merged by reciprocal rank fusion; scores reflect
+    ranks, not similarity). Scores are between 0 and 1, higher is better.
     """
-    # Get search results (document IDs and scores)
-    search_results = search_engine.search(query, top_k=5)
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(SEARCH_MODES)}")
+
+    # Identical searches by the same role against the same index are answered from the cache
+    cache_key = (normalize_query(query), current_user['role'], SEARCH_TOP_K, mode, search_engine.version)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        log_access(current_user['username'], 'search', None)
+        return JSONResponse(content=cached)
+    
+    # Get search results (document IDs and scores), restricted to what the role may see
+    categories = security.accessible_categories(current_user['role'])
+    search_results = await ranked_hits(query, mode, categories)
     
     # If no results found, return empty list
     if not search_results:
+        search_cache.set(cache_key, [])
         log_access(current_user['username'], 'search', None)
         return JSONResponse(content=[])
     
-    # Category-specific fallback messages and team authors
-    category_fallbacks = {
-        'HR': 'HR-related document',
-        'Finance': 'Finance-related document', 
-        'Legal': 'Legal-related document',
-        'Admin': 'Administrative document'
-    }
-    
-    team_authors = {
-        'HR': 'hr_team',
-        'Finance': 'finance_team',
-        'Legal': 'legal_team',
-        'Admin': 'admin_team'
-    }
-    
-    # Fetch full document details from database
-    detailed_results = []
+    # Fetch the hits and the text for their snippets in one query each
+    scores = {result['document_id']: result for result in search_results}
+    documents, passages = await run_in_threadpool(fetch_hits, scores, current_user['role'])
     
-    for result in search_results:
-        doc_id = result['document_id']
-        doc = get_document_by_id(doc_id)
-        
-        if doc and security.has_access(current_user['role'], doc[5]):  # doc[5] is category
-            # Helper function to handle null/empty values
-            def safe_value(value, fallback="No information available"):
-                if value is None or value == "" or value == "Unknown" or value == "Untitled":
-                    return fallback
-                return value
-            
-            # Get category-specific fallback based on user role
-            category_fallback = category_fallbacks.get(current_user['role'], 'General document')
-            
-            # Get team author based on category
-            actual_category = doc[5] if doc[5] and doc[5] != "" else current_user['role']
-            team_author = team_authors.get(actual_category, f"{current_user['role'].lower()}_team")
-            
-            # Parse entities safely
-            entities = {}
-            try:
-                if doc[10] and doc[10] != "null":
-                    entities = json.loads(doc[10])
-            except (json.JSONDecodeError, TypeError):
-                entities = {}
-            
-            detailed_results.append({
-                'id': doc[0],           # id
-                'filename': safe_value(doc[1], "Unknown file"),     # filename
-                'filepath': doc[2],     # filepath
-                'upload_date': doc[3],  # upload_date
-                'uploader': safe_value(doc[4], "Unknown user"),     # uploader
-                'category': safe_value(doc[5], category_fallback),  # category
-                'title': safe_value(doc[6], "No title available"), # title
-                'author': team_author,  # Use team author instead of doc[7]
-                'summary': safe_value(doc[9], "No summary available"), # summary
-                'entities': entities if entities else {},
-                'search_score': result['score']  # Include relevance score
-            })
+    detailed_results = []
+    for doc in documents:
+        result = scores[doc['id']]
+        detailed = format_document(doc, current_user['role'])
+        detailed['search_score'] = result['score']  # Include relevance score
+        if result['chunk_no'] is not None:
+            detailed['snippet'] = passages.get((doc['id'], result['chunk_no']), '')  # Best matching passage
+        else:
+            detailed['snippet'] = result.get('snippet') or ''  # Keyword match in context
+        detailed_results.append(detailed)
     
+    search_cache.set(cache_key, detailed_results)
     log_access(current_user['username'], 'search', None)
     return JSONResponse(content=detailed_results)
 
+@app.get("/cache/stats")
+def cache_stats(current_user: dict = Depends(get_user_from_query)):
+    """Reports size and hit/miss counters of the caches, for tuning their sizes (admin only)."""
+    if current_user['role'] != 'Admin':
+        raise HTTPException(status_code=403, detail="Only admins can view cache statistics")
+    return JSONResponse(content={
+        "query_embeddings": search_engine.cache_stats(),
+        "search_results": search_cache.stats(),
+        "credentials": security.cache_stats(),
+        "access_log": access_log.stats(),
+        "index_version": search_engine.version
+    })
+
+@app.get("/access-logs/")
+def access_logs(
+    username: Optional[str] = None,
+    action: Optional[str] = None,
+    document_id: Optional[int] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    before_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: dict = Depends(get_user_from_query)
+):
+    """
+    Lists access-log entries, newest first (admin only).
+
+    Filters combine; since/until are UTC timestamps. Pass the id of the last
+    entry as before_id to get the next page.
+    """
+    if current_user['role'] != 'Admin':
+        raise HTTPException(status_code=403, detail="Only admins can view access logs")
+    # Include events that are still buffered
+    access_log.flush()
+    return JSONResponse(content=query_access_logs(username, action, document_id, since, until, before_id, limit))
+
+# Cleanups are plain functions, so FastAPI runs them in its threadpool and a
+# large purge (and any index rebuild it triggers) does not block other requests
 @app.post("/cleanup-invalid-documents/")
-async def cleanup_invalid_documents_endpoint(current_user: dict = Depends(get_user_from_query)):
+def cleanup_invalid_documents_endpoint(current_user: dict = Depends(get_user_from_query)):
     """
     Manually clean up documents with invalid dates. Only admin can perform this action.
     """
@@ -272,31 +860,18 @@ async def cleanup_invalid_documents_endpoint(current_user: dict = Depends(get_us
         raise HTTPException(status_code=403, detail="Only admin can perform cleanup operations")
     
     try:
-        deleted_count = cleanup_invalid_documents()
+        deleted = cleanup_invalid_documents()
         
-        # Rebuild search index after cleanup
-        print("Rebuilding search index after cleanup...")
-        search_engine.documents = []
-        search_engine.document_ids = []
-        search_engine.index = None
-        search_engine.embeddings = None
-        
-        all_docs = get_documents_by_role("Admin")
-        for doc in all_docs:
-            try:
-                doc_text = extract_text(doc[2])
-                search_engine.add_document(doc[0], doc_text)
-            except Exception as e:
-                print(f"Error rebuilding index for document ID {doc[0]}: {e}")
-                continue
+        # Drop exactly the deleted documents from the search index and the disk
+        remove_deleted_documents(deleted)
         
         log_access(current_user['username'], 'cleanup', None)
-        return JSONResponse(content={"message": f"Cleaned up {deleted_count} documents with invalid dates"})
+        return JSONResponse(content={"message": f"Cleaned up {len(deleted)} documents with invalid dates"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Cleanup failed: {str(e)}")
 
 @app.post("/force-cleanup-all-documents/")
-async def force_cleanup_all_documents_endpoint(current_user: dict = Depends(get_user_from_query)):
+def force_cleanup_all_documents_endpoint(current_user: dict = Depends(get_user_from_query)):
     """
     Completely clear all documents with invalid dates. Only admin can perform this action.
     """
@@ -304,31 +879,20 @@ async def force_cleanup_all_documents_endpoint(current_user: dict = Depends(get_
         raise HTTPException(status_code=403, detail="Only admin can perform force cleanup operations")
     
     try:
-        deleted_count = force_cleanup_all_documents()
-        
-        # Rebuild search index after cleanup
-        print("Rebuilding search index after cleanup...")
-        search_engine.documents = []
-        search_engine.document_ids = []
-        search_engine.index = None
-        search_engine.embeddings = None
+        deleted = force_cleanup_all_documents()
         
-        all_docs = get_documents_by_role("Admin")
-        for doc in all_docs:
-            try:
-                doc_text = extract_text(doc[2])
-                search_engine.add_document(doc[0], doc_text)
-            except Exception as e:
-                print(f"Error rebuilding index for document ID {doc[0]}: {e}")
-                continue
+        # Drop exactly the deleted documents from the search index and the disk
+        remove_deleted_documents(deleted)
         
         log_access(current_user['username'], 'force_cleanup', None)
-        return JSONResponse(content={"message": f"Force cleaned up {deleted_count} documents with invalid dates"})
+        return JSONResponse(content={"message": f"Force cleaned up {len(deleted)} documents with invalid dates"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Force cleanup failed: {str(e)}")
 
+# Plain def like the cleanups: removing passages from the index takes the
+# engine lock (or a model server call), which must not block the event loop
 @app.delete("/documents/{doc_id}")
-async def delete_document_endpoint(
+def delete_document_endpoint(
     doc_id: int,
     current_user: dict = Depends(get_user_from_query)
 ):
@@ -344,32 +908,17 @@ async def delete_document_endpoint(
     if current_user['role'] != 'Admin' and doc[4] != current_user['username']:
         raise HTTPException(status_code=403, detail="Permission denied")
     
-    # Delete the physical file if it exists
-    file_path = doc[2]  # doc[2] is filepath
-    if os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-        except Exception as e:
-            print(f"Warning: Could not delete file {file_path}: {e}")
-    
     # Remove from search index to prevent ML model issues
     try:
-        # Remove from search engine index if it exists
-        if hasattr(search_engine, 'documents'):
-            search_engine.documents = [(d_id, text) for d_id, text in search_engine.documents if d_id != doc_id]
-            search_engine.document_ids = [d_id for d_id in search_engine.document_ids if d_id != doc_id]
-            # Rebuild index without the deleted document
-            if search_engine.documents:
-                search_engine.rebuild_index()
-            else:
-                search_engine.index = None
-                search_engine.embeddings = None
+        search_engine.remove_document(doc_id)
     except Exception as e:
         print(f"Warning: Could not update search index: {e}")
     
     # Delete from database
     success = delete_document(doc_id)
     if success:
+        # Delete the physical file unless an identical upload still points to it
+        delete_orphaned_files([doc[2]])  # doc[2] is filepath
         log_access(current_user['username'], 'delete', doc_id)
         return JSONResponse(content={"message": "Document deleted successfully"})
     else:
@@ -382,4 +931,22 @@ async def register_new_user(username: str = Form(...), password: str = Form(...)
     if user:
         return JSONResponse(content={"message": "User registered successfully"})
     else:
-        raise HTTPException(status_code=400, detail="Username already exists")
\ No newline at end of file
+        raise HTTPException(status_code=400, detail="Username already exists")
+
+@app.put("/users/{username}")
+async def update_user_endpoint(
+    username: str,
+    password: Optional[str] = Form(None),
+    role: Optional[str] = Form(None),
+    current_user: dict = Depends(get_user_from_query)
+):
+    """Changes a user's password or role. Only admin can perform this action."""
+    if current_user['role'] != 'Admin':
+        raise HTTPException(status_code=403, detail="Only admin can update users")
+    if not password and not role:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+
+    if update_user(username, password, role):
+        return JSONResponse(content={"message": "User updated successfully"})
+    else:
+        raise HTTPException(status_code=404, detail="User not found")
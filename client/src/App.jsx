@@ -14,6 +14,7 @@ function App() {
   const [password, setPassword] = useState('');
   const [isRegistering, setIsRegistering] = useState(false);
   const [fetchError, setFetchError] = useState('');
+  const [nextCursor, setNextCursor] = useState(null);
 
   useEffect(() => {
     if (isAuthenticated) {
@@ -34,26 +35,34 @@ function App() {
     setUsername('');
     setPassword('');
     setDocuments([]);
+    setNextCursor(null);
   };
 
-  const fetchDocuments = async () => {
+  // Fetches one page of the list: the first page replaces the list, later
+  // pages (requested with the X-Next-Cursor of the previous one) are appended
+  const fetchDocumentsPage = async (cursor) => {
     try {
       console.log('Fetching documents for user:', username);
-      console.log('API URL:', `${API_BASE_URL}/documents/?username=${username}&password=${password}`);
+      const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+      console.log('API URL:', `${API_BASE_URL}/documents/?username=${username}&password=${password}${cursorParam}`);
       
-      const response = await fetch(`${API_BASE_URL}/documents/?username=${username}&password=${password}`);
+      const response = await fetch(`${API_BASE_URL}/documents/?username=${username}&password=${password}${cursorParam}`);
       console.log('Fetch response status:', response.status);
       
       if (response.ok) {
         const data = await response.json();
         console.log('Fetched documents:', data);
-        setDocuments(data);
+        setDocuments((previous) => (cursor ? [...previous, ...data] : data));
+        setNextCursor(response.headers.get('X-Next-Cursor'));
         setFetchError('');
       } else {
         const errorText = await response.text();
         console.error('Fetch failed:', response.status, errorText);
         setFetchError(`Failed to fetch documents. Status: ${response.status}`);
-        setDocuments([]);
+        if (!cursor) {
+          setDocuments([]);
+          setNextCursor(null);
+        }
       }
     } catch (error) {
       console.error('Fetch error:', error);
@@ -61,6 +70,10 @@ function App() {
     }
   };
 
+  const fetchDocuments = () => fetchDocumentsPage(null);
+
+  const loadMoreDocuments = () => fetchDocumentsPage(nextCursor);
+
   const handleSearch = async (searchQuery) => {
     try {
       console.log('Searching for:', searchQuery);
@@ -73,12 +86,14 @@ function App() {
         const data = await response.json();
         console.log('Search results:', data);
         setDocuments(data);
+        setNextCursor(null);
         setFetchError('');
       } else {
         const errorText = await response.text();
         console.error('Search failed:', response.status, errorText);
         setFetchError(`Failed to search documents. Status: ${response.status}`);
         setDocuments([]);
+        setNextCursor(null);
       }
     } catch (error) {
       console.error('Search error:', error);
@@ -190,6 +205,9 @@ function App() {
         </section>
         <section className="section-documents">
           <DocumentList documents={documents} onDelete={handleDelete} />
+          {nextCursor && (
+            <button onClick={loadMoreDocuments} className="load-more-button">Load More Documents</button>
+          )}
         </section>
       </main>
       {fetchError && <p className="error-message">{fetchError}</p>}
@@ -15,6 +15,21 @@ const DocumentUpload = ({ username, password, onUploadSuccess }) => {
     setUploadMessage('');
   };
 
+  const waitForJob = async (jobId) => {
+    const params = new URLSearchParams({ username, password });
+    while (true) {
+      const response = await fetch(`${API_BASE_URL}/jobs/${jobId}?${params}`);
+      if (!response.ok) {
+        return { status: 'failed', error: `Status check failed (${response.status})` };
+      }
+      const job = await response.json();
+      if (job.status === 'completed' || job.status === 'failed') {
+        return job;
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+  };
+
   const handleUpload = async (e) => {
     e.preventDefault();
     if (!file) {
@@ -38,12 +53,19 @@ const DocumentUpload = ({ username, password, onUploadSuccess }) => {
 
       if (response.ok) {
         const result = await response.json();
-        setUploadMessage('Document uploaded and processed successfully!');
+        setUploadMessage('Document uploaded, processing...');
         setFile(null);
         // Reset file input
         e.target.reset();
-        // Refresh documents list
-        if (onUploadSuccess) onUploadSuccess();
+        // Processing runs in the background; wait for the job to finish
+        const job = await waitForJob(result.job_id);
+        if (job.status === 'completed') {
+          setUploadMessage('Document uploaded and processed successfully!');
+          // Refresh documents list
+          if (onUploadSuccess) onUploadSuccess();
+        } else {
+          setUploadMessage(`Processing failed: ${job.error || 'Unknown error'}`);
+        }
       } else {
         const errorData = await response.json();
         setUploadMessage(`Upload failed: ${errorData.detail || 'Unknown error'}`);
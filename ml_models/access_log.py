@@ -0,0 +1,163 @@
+import datetime
+import os
+import threading
+import time
+from .connection import get_connection
+
+# Events are written at least this often, so a crash loses at most this many
+# seconds of audit log; a full batch is written right away
+AUDIT_FLUSH_SECONDS = float(os.environ.get('AUDIT_FLUSH_SECONDS', 1.0))
+AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 500))
+# Rows older than this many days are deleted; 0 keeps everything
+AUDIT_RETENTION_DAYS = int(os.environ.get('AUDIT_RETENTION_DAYS', 365))
+RETENTION_INTERVAL_SECONDS = 3600
+PURGE_CHUNK_ROWS = 5000
+
+def _timestamp(moment: datetime.datetime) -> str:
+    """Same format (UTC) as SQLite's CURRENT_TIMESTAMP, which older rows were written with."""
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+class AccessLogWriter:
+    """
+    Buffers access-log events in memory and writes them in batched
+    transactions from a background thread.
+
+    log() only appends to a list, so logging stays off the request's hot
+    path and out of the way of document inserts competing for the write
+    lock. The thread starts on first use, and again in a forked worker.
+    """
+
+    def __init__(self, flush_seconds: float = AUDIT_FLUSH_SECONDS, batch_size: int = AUDIT_BATCH_SIZE,
+                 retention_days: int = AUDIT_RETENTION_DAYS):
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.retention_days = retention_days
+        self._events = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one writer at a time, in order
+        self._wake = threading.Event()
+        self._stopped = False
+        self._pid = None
+        self._thread = None
+
+    def log(self, username: str, action: str, doc_id: int = None):
+        """Queues one event, stamped now."""
+        event = (_timestamp(datetime.datetime.now(datetime.timezone.utc)), action, username, doc_id)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            self._events.append(event)
+            full = len(self._events) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def _start(self):
+        # Events buffered by the parent before a fork are the parent's to write
+        self._events = []
+        self._pid = os.getpid()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        next_purge = time.monotonic()
+        while not self._stopped:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+            if self.retention_days and time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + RETENTION_INTERVAL_SECONDS
+                try:
+                    purge_access_logs(self.retention_days)
+                except Exception as e:
+                    print(f"Could not purge old access logs: {e}")
+
+    def flush(self) -> int:
+        """Writes all buffered events in one transaction. Returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if not events:
+                return 0
+            try:
+                with get_connection() as conn:
+                    conn.executemany('''
+                        INSERT INTO access_logs (timestamp, action, username, document_id)
+                        VALUES (?, ?, ?, ?)
+                    ''', events)
+            except Exception as e:
+                # Keep the events for the next attempt, e.g. while the database is locked
+                print(f"Could not write {len(events)} access log events: {e}")
+                with self._lock:
+                    self._events[:0] = events
+                return 0
+            return len(events)
+
+    def close(self):
+        """Stops the background thread and writes what is still buffered."""
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_seconds + 5)
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'buffered': len(self._events), 'flush_seconds': self.flush_seconds,
+                    'batch_size': self.batch_size, 'retention_days': self.retention_days}
+
+def purge_access_logs(retention_days: int = AUDIT_RETENTION_DAYS) -> int:
+    """
+    Deletes access-log rows older than retention_days, oldest first.
+
+    Rows go in short transactions of PURGE_CHUNK_ROWS found through the
+    timestamp index, so a large backlog never holds the write lock for long.
+    """
+    cutoff = _timestamp(datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=retention_days))
+    deleted = 0
+    while True:
+        with get_connection() as conn:
+            c = conn.execute('''
+                DELETE FROM access_logs WHERE id IN (
+                    SELECT id FROM access_logs WHERE timestamp < ? ORDER BY timestamp LIMIT ?
+                )
+            ''', (cutoff, PURGE_CHUNK_ROWS))
+            count = c.rowcount
+        deleted += count
+        if count < PURGE_CHUNK_ROWS:
+            return deleted
+
+def query_access_logs(username: str = None, action: str = None, document_id: int = None,
+                      since: str = None, until: str = None, before_id: int = None, limit: int = 100):
+    """
+    Returns access-log rows matching the given filters, newest first.
+
+    Args:
+        since, until: Timestamps ('YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS', UTC);
+            since is inclusive, until exclusive.
+        before_id: The id of the last row of the previous page, to page backwards.
+        limit: Maximum number of rows.
+    """
+    conditions, params = [], []
+    for column, value in (('username', username), ('action', action), ('document_id', document_id)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if since:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        conditions.append("timestamp < ?")
+        params.append(until)
+    if before_id is not None:
+        conditions.append("id < ?")
+        params.append(before_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    with get_connection() as conn:
+        c = conn.execute(f'''
+            SELECT id, timestamp, action, username, document_id FROM access_logs
+            {where} ORDER BY id DESC LIMIT ?
+        ''', params + [limit])
+        return [dict(row) for row in c.fetchall()]
+
+access_log = AccessLogWriter()
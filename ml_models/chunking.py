@@ -0,0 +1,80 @@
+import re
+from itertools import islice
+
+# MiniLM truncates input after ~256 word pieces, which is roughly 200 words
+PASSAGE_WORDS = 200
+PASSAGE_OVERLAP = 40
+
+_WORD_RE = re.compile(r'\S+')
+
+def iter_passages(pieces, passage_words: int = PASSAGE_WORDS, overlap: int = PASSAGE_OVERLAP):
+    """
+    Splits streamed text into overlapping passages of whole words.
+
+    Args:
+        pieces: A string, or an iterable of text fragments (pages, paragraphs)
+            that together form the document.
+        passage_words: Number of words per passage.
+        overlap: Number of words shared by consecutive passages.
+
+    Yields:
+        (chunk_no, start, end, passage) tuples, where start/end are character
+        offsets into the concatenated text.
+    """
+    if isinstance(pieces, str):
+        pieces = [pieces]
+    step = max(1, passage_words - overlap)
+
+    window = []  # (start, end, word) for the words of the current passage
+    new_words = 0  # words in the window not yet emitted in any passage
+    chunk_no = 0
+    carry = ''  # trailing partial word of the previous piece
+    offset = 0  # character offset of the end of the previous piece
+
+    def emit():
+        passage = ' '.join(word for _, _, word in window)
+        return chunk_no, window[0][0], window[-1][1], passage
+
+    for piece in pieces:
+        if not piece:
+            continue
+        text = carry + piece
+        base = offset - len(carry)
+        offset += len(piece)
+
+        matches = list(_WORD_RE.finditer(text))
+        carry = ''
+        if matches and not text[-1].isspace():
+            # The last word may continue in the next piece
+            carry = matches.pop().group(0)
+
+        for match in matches:
+            window.append((base + match.start(), base + match.end(), match.group(0)))
+            new_words += 1
+            if len(window) == passage_words:
+                yield emit()
+                chunk_no += 1
+                window = window[step:]
+                new_words = 0
+
+    if carry:
+        window.append((offset - len(carry), offset, carry))
+        new_words += 1
+    if window and new_words:
+        yield emit()
+
+def batched(iterable, batch_size: int):
+    """Yields lists of up to batch_size items from an iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def get_passage(text: str, chunk_no: int) -> str:
+    """Returns the original text of one passage, e.g. to show it as a search snippet."""
+    for number, start, end, _ in iter_passages(text):
+        if number == chunk_no:
+            return text[start:end]
+    return ''
@@ -1,34 +1,195 @@
-from transformers import pipeline
+import os
+import numpy as np
+from .chunking import iter_passages
+from .inference_backend import load_zero_shot_pipeline, INFERENCE_BACKEND
+from .model_registry import registry
+
+ZERO_SHOT_MODEL = "facebook/bart-large-mnli"
+
+# 'embedding' scores document embeddings against label prototypes and only asks
+# the zero-shot model about uncertain documents; 'zero-shot' always uses BART
+CLASSIFIER_MODE = os.environ.get('CLASSIFIER_MODE', 'embedding')
+MIN_CONFIDENCE = float(os.environ.get('CLASSIFIER_MIN_CONFIDENCE', 0.5))
+
+# Zero-shot reads up to this many chunks spread over the document and averages
+# their label scores; every chunk costs one NLI pass per label
+MAX_CHUNKS = int(os.environ.get('CLASSIFIER_MAX_CHUNKS', 4))
+CHUNK_WORDS = 300  # stays well inside BART's 1024 token limit
+
+# Softmax temperature for cosine similarities, which only span a narrow range
+SIMILARITY_TEMPERATURE = 0.05
+# Past documents a label needs before its learned centroid replaces the prototype
+MIN_TRAINING_EXAMPLES = 5
+
+# Short descriptions the label prototypes are embedded from
+LABEL_DESCRIPTIONS = {
+    "Finance": "Financial report with budgets, revenue, expenses, balance sheets, profit and loss, forecasts and accounting figures.",
+    "HR": "Human resources document about employees, hiring, onboarding, benefits, leave, payroll, performance reviews and workplace policies.",
+    "Technical Reports": "Technical report describing system architecture, engineering design, experiments, measurements, specifications and test results.",
+    "Contracts": "Contract or agreement between parties with terms and conditions, obligations, duration, termination, signatures and effective date.",
+    "Invoices": "Invoice or bill listing items, quantities, unit prices, totals, taxes, payment terms, due date and invoice number.",
+    "Legal": "Legal document concerning law, regulations, compliance, litigation, court proceedings, liability and legal counsel.",
+    "Marketing": "Marketing material about campaigns, brand, customers, market research, advertising, social media and sales promotion.",
+    "Project Management": "Project plan or status report with milestones, timelines, deliverables, tasks, risks, resources and stakeholders."
+}
 
 class DocumentClassifier:
-    """Classifies documents using a zero-shot approach."""
-    
-    def __init__(self):
+    """
+    Classifies documents into the predefined categories.
+
+    The zero-shot model votes over several chunks of each document instead
+    of only reading its beginning; max_chunks bounds the cost per document.
+
+    In embedding mode a document is classified from its sentence embedding,
+    by cosine similarity to one vector per label: an embedded label
+    description, or the centroid of past documents once fit_head() has seen
+    enough of them. Only documents below MIN_CONFIDENCE go to the zero-shot
+    model. Both models are loaded through the model registry on first use.
+    """
+
+    def __init__(self, mode: str = CLASSIFIER_MODE, encoder=None, min_confidence: float = MIN_CONFIDENCE,
+                 max_chunks: int = MAX_CHUNKS, backend: str = INFERENCE_BACKEND):
+        """
+        Args:
+            mode: 'embedding' or 'zero-shot'.
+            encoder: The SentenceTransformer that produced the document
+                embeddings; needed to embed the label prototypes. Defaults
+                to the search engine's 'encoder' in the model registry.
+            min_confidence: Embedding predictions below this go to zero-shot.
+            max_chunks: Chunks per document the zero-shot model classifies.
+            backend: Inference backend of the zero-shot model, see inference_backend.
+        """
+        self.mode = mode
+        self._encoder = encoder
+        self.min_confidence = min_confidence
+        self.max_chunks = max(1, max_chunks)
+        self.candidate_labels = list(LABEL_DESCRIPTIONS)
+        self._label_vectors = None  # (labels, dim), unit length
+        self._centroids = {}  # label -> centroid learned by fit_head
+        registry.register('zero_shot', lambda: load_zero_shot_pipeline(ZERO_SHOT_MODEL, backend))
+
+    @property
+    def classifier(self):
+        """The zero-shot pipeline, loaded on first use."""
         # Use a zero-shot classification pipeline from Hugging Face
-        self.classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
-        self.candidate_labels = [
-            "Finance",
-            "HR",
-            "Technical Reports",
-            "Contracts",
-            "Invoices",
-            "Legal",
-            "Marketing",
-            "Project Management"
-        ]
-
-    def classify_document(self, text: str) -> str:
+        return registry.get('zero_shot')
+
+    @property
+    def encoder(self):
+        return self._encoder if self._encoder is not None else registry.get('encoder')
+
+    def _use_embeddings(self) -> bool:
+        return self.mode == 'embedding' and (self._encoder is not None or registry.is_registered('encoder'))
+
+    def _prototypes(self):
+        if self._label_vectors is None:
+            vectors = self.encoder.encode([LABEL_DESCRIPTIONS[label] for label in self.candidate_labels])
+            label_vectors = _normalize(np.asarray(vectors, dtype='float32'))
+            for n, label in enumerate(self.candidate_labels):
+                if label in self._centroids:
+                    label_vectors[n] = self._centroids[label]
+            self._label_vectors = label_vectors
+        return self._label_vectors
+
+    def fit_head(self, embeddings, labels):
+        """
+        Learns label vectors from already classified documents.
+
+        Args:
+            embeddings: (documents, dim) matrix of document embeddings.
+            labels: The category of each document.
+
+        Returns:
+            The labels that now use a learned centroid.
+        """
+        if self.mode != 'embedding' or len(labels) == 0:
+            return []
+        embeddings = _normalize(np.asarray(embeddings, dtype='float32'))
+        centroids = {}
+        for label in self.candidate_labels:
+            mask = np.array([l == label for l in labels])
+            if mask.sum() >= MIN_TRAINING_EXAMPLES:
+                centroids[label] = _normalize(embeddings[mask].mean(axis=0, keepdims=True))[0]
+        # The label vectors are rebuilt on next use, which also keeps the encoder unloaded until then
+        self._centroids = centroids
+        self._label_vectors = None
+        return list(centroids)
+
+    def classify_document(self, text: str, embedding=None) -> str:
         """
         Classifies the document text into one of the predefined categories.
-        
+
         Args:
             text: The content of the document.
-        
+            embedding: The document's embedding, if already computed.
+
         Returns:
             The predicted category with the highest confidence.
         """
-        # Truncate text to fit model's max sequence length (512)
-        truncated_text = text[:512]
-        result = self.classifier(truncated_text, self.candidate_labels)
-        
-        return result['labels'][0]
\ No newline at end of file
+        return self.classify_documents([text], None if embedding is None else [embedding])[0]
+
+    def classify_documents(self, texts, embeddings=None, batch_size: int = 8):
+        """
+        Classifies several documents with batched forward passes.
+
+        Args:
+            texts: List of document contents.
+            embeddings: Optional document embeddings, one per text, e.g. the
+                mean of the passage vectors computed for search.
+            batch_size: Number of sequences per model batch.
+
+        Returns:
+            The predicted category of each document, in order.
+        """
+        if not self._use_embeddings():
+            return self._classify_zero_shot(texts, batch_size)
+
+        if embeddings is None:
+            embeddings = self.encoder.encode(list(texts))
+        embeddings = _normalize(np.asarray(embeddings, dtype='float32').reshape(len(texts), -1))
+        scores = _softmax(embeddings @ self._prototypes().T / SIMILARITY_TEMPERATURE)
+
+        categories = [self.candidate_labels[n] for n in scores.argmax(axis=1)]
+        uncertain = [n for n, confidence in enumerate(scores.max(axis=1)) if confidence < self.min_confidence]
+        if uncertain:
+            fallback = self._classify_zero_shot([texts[n] for n in uncertain], batch_size)
+            for n, category in zip(uncertain, fallback):
+                categories[n] = category
+        return categories
+
+    def _sample_chunks(self, text: str):
+        """Picks up to max_chunks passages spread evenly over the text, so a cover page cannot decide alone."""
+        chunks = [passage for _, _, _, passage in iter_passages(text, CHUNK_WORDS, 0)]
+        if len(chunks) <= self.max_chunks:
+            return chunks or ['']
+        positions = np.linspace(0, len(chunks) - 1, self.max_chunks).round().astype(int)
+        return [chunks[n] for n in positions]
+
+    def _classify_zero_shot(self, texts, batch_size: int):
+        # All chunks of all documents go through the model as one batch
+        owners = []
+        chunks = []
+        for n, text in enumerate(texts):
+            for chunk in self._sample_chunks(text):
+                owners.append(n)
+                chunks.append(chunk)
+        results = self.classifier(chunks, self.candidate_labels, batch_size=batch_size)
+
+        # The pipeline returns a single dict for a single input
+        if isinstance(results, dict):
+            results = [results]
+
+        # Average each document's label scores over its chunks
+        label_index = {label: n for n, label in enumerate(self.candidate_labels)}
+        scores = np.zeros((len(texts), len(self.candidate_labels)))
+        for owner, result in zip(owners, results):
+            for label, score in zip(result['labels'], result['scores']):
+                scores[owner, label_index[label]] += score
+        return [self.candidate_labels[n] for n in scores.argmax(axis=1)]
+
+def _normalize(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def _softmax(scores):
+    scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+    return scores / scores.sum(axis=1, keepdims=True)
@@ -0,0 +1,102 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DATABASE_FILE = 'data/documents.db'
+POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 8))
+
+# Applied to every new connection. WAL lets readers run alongside a writer,
+# busy_timeout makes writers wait for the lock instead of failing with
+# "database is locked".
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",  # 64 MB page cache
+    "PRAGMA mmap_size=268435456",  # 256 MB memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+class ConnectionPool:
+    """
+    A thread-safe pool of long-lived SQLite connections.
+
+    Connections are created lazily up to `size` and handed out one per
+    caller. Each keeps its own prepared-statement cache, so the same SQL
+    text is only compiled once per connection.
+    """
+
+    def __init__(self, database: str, size: int = POOL_SIZE):
+        self.database = database
+        self.size = size
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=5, check_same_thread=False, cached_statements=256)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        # Rows still index like tuples, but can also be read by column name
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        """
+        Lends out a connection for one unit of work. The transaction is
+        committed when the block exits normally and rolled back on error.
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def close_all(self):
+        """Closes all idle connections."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide pool, creating a fresh one after a fork."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool(DATABASE_FILE)
+        return _pool
+
+def get_connection():
+    """Shortcut for `get_pool().connection()`."""
+    return get_pool().connection()
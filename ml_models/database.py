@@ -1,14 +1,58 @@
-import sqlite3
 import json
+import re
+import sqlite3
+import time
+import zlib
+from .connection import DATABASE_FILE, get_connection
+from .access_log import access_log
+from .chunking import iter_passages
 from .security_manager import SecurityManager
 
-DATABASE_FILE = 'data/documents.db'
+DOCUMENT_COLUMNS = (
+    'id', 'filename', 'filepath', 'upload_date', 'uploader', 'category',
+    'title', 'author', 'date_extracted', 'summary', 'entities'
+)
 
-def init_db():
-    """Initializes the SQLite database with the required tables."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    
+# Stay well below SQLite's limit on bound parameters per statement
+MAX_BATCH_PARAMETERS = 500
+
+# How long a starting worker waits for another one to finish migrating the
+# schema, e.g. backfilling the full-text index of a large database
+SCHEMA_LOCK_TIMEOUT_SECONDS = 600
+
+# Words of a keyword query; quotes would end an FTS5 phrase early
+FTS_TERM = re.compile(r'[^\s"]*\w[^\s"]*')
+
+def _select_columns(columns=None):
+    """Builds a SELECT column list from a projection; the id is always included."""
+    if columns is None:
+        return '*'
+    unknown = set(columns) - set(DOCUMENT_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown document columns: {', '.join(sorted(unknown))}")
+    return ', '.join(['id'] + [col for col in DOCUMENT_COLUMNS if col in columns and col != 'id'])
+
+def ensure_schema():
+    """
+    Creates any missing tables and migrates older ones. Safe to run on every
+    startup, also from several workers at once: everything runs in one write
+    transaction, so each check sees what another worker already migrated.
+    """
+    with get_connection() as conn:
+        c = conn.cursor()
+        deadline = time.monotonic() + SCHEMA_LOCK_TIMEOUT_SECONDS
+        while True:
+            try:
+                c.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as e:
+                # Each attempt already waits for the connection's busy_timeout
+                if 'locked' not in str(e) or time.monotonic() > deadline:
+                    raise
+        _create_schema(c)
+
+def _create_schema(c):
+    """Creates and migrates the tables; call inside a write transaction."""
     # Create tables
     c.execute('''
         CREATE TABLE IF NOT EXISTS documents (
@@ -25,14 +69,19 @@ def init_db():
             entities TEXT
         )
     ''')
-    
+
     c.execute('''
         CREATE TABLE IF NOT EXISTS users (
             username TEXT PRIMARY KEY,
             password TEXT NOT NULL,
-            role TEXT NOT NULL
+            role TEXT NOT NULL,
+            credentials_version INTEGER NOT NULL DEFAULT 0
         )
     ''')
+    # Bumped on every password or role change; tokens and cached logins carry it
+    user_columns = {row[1] for row in c.execute("PRAGMA table_info(users)").fetchall()}
+    if 'credentials_version' not in user_columns:
+        c.execute("ALTER TABLE users ADD COLUMN credentials_version INTEGER NOT NULL DEFAULT 0")
 
     c.execute('''
         CREATE TABLE IF NOT EXISTS access_logs (
@@ -45,6 +94,153 @@ def init_db():
         )
     ''')
 
+    # Extracted text is stored once, zlib-compressed, so files never need re-parsing
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS document_contents (
+            document_id INTEGER PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            text BLOB NOT NULL,
+            FOREIGN KEY (document_id) REFERENCES documents(id)
+        )
+    ''')
+
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS documents_delete_contents
+        AFTER DELETE ON documents
+        BEGIN
+            DELETE FROM document_contents WHERE document_id = old.id;
+        END
+    ''')
+
+    # The original text of every indexed passage, so a search hit's snippet is
+    # one primary-key lookup instead of decompressing and re-chunking the document
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS document_passages (
+            document_id INTEGER NOT NULL,
+            chunk_no INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (document_id, chunk_no)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS documents_delete_passages
+        AFTER DELETE ON documents
+        BEGIN
+            DELETE FROM document_passages WHERE document_id = old.id;
+        END
+    ''')
+
+    # Every upload of a document, including re-uploads of identical files
+    # that were linked to the existing document instead of being processed again
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS document_uploads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            document_id INTEGER NOT NULL,
+            uploader TEXT,
+            filename TEXT,
+            upload_date TEXT,
+            FOREIGN KEY (document_id) REFERENCES documents(id)
+        )
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS documents_delete_uploads
+        AFTER DELETE ON documents
+        BEGIN
+            DELETE FROM document_uploads WHERE document_id = old.id;
+        END
+    ''')
+
+    # Corpus statistics for TF-IDF summaries: in how many documents each
+    # term occurs, and how many documents were counted
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS term_frequencies (
+            term TEXT PRIMARY KEY,
+            document_count INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS corpus_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+
+    # Upload job status, shared by all worker processes (see ingestion.SQLiteJobStore)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ingestion_jobs (
+            id TEXT PRIMARY KEY,
+            owner TEXT,
+            status TEXT NOT NULL,
+            stage TEXT,
+            progress REAL NOT NULL DEFAULT 0,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_updated ON ingestion_jobs (updated_at)")
+
+    # Indexes for role-filtered, keyset-paginated listings
+    c.execute("CREATE INDEX IF NOT EXISTS idx_documents_category ON documents (category, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_documents_category_upload_date ON documents (category, upload_date, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_documents_upload_date ON documents (upload_date, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_documents_uploader ON documents (uploader)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_documents_filepath ON documents (filepath)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_document_contents_hash ON document_contents (content_hash)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_document_uploads_document ON document_uploads (document_id)")
+    # Access-log retention and queries
+    c.execute("CREATE INDEX IF NOT EXISTS idx_access_logs_timestamp ON access_logs (timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_access_logs_username ON access_logs (username, timestamp)")
+
+    # Full-text index for keyword search, one row per document with rowid = documents.id.
+    # Rows are written together with the document text and dropped with the document.
+    backfill = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'documents_fts'").fetchone() is None
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts
+        USING fts5(title, summary, entities, body, tokenize = 'unicode61 remove_diacritics 2')
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS documents_delete_fts
+        AFTER DELETE ON documents
+        BEGIN
+            DELETE FROM documents_fts WHERE rowid = old.id;
+        END
+    ''')
+    if backfill:
+        _backfill_fts(c)
+
+def _fts_row(doc_id, title, summary, entities, text):
+    """Builds a documents_fts row; entity names are indexed, their counts are not."""
+    if isinstance(entities, str):
+        entities = json.loads(entities or '{}')
+    names = ' '.join(name for values in (entities or {}).values() for name in values)
+    return (doc_id, title or '', summary or '', names, text or '')
+
+def _backfill_fts(c):
+    """Indexes documents stored before the full-text table existed."""
+    c.execute('''
+        SELECT d.id, d.title, d.summary, d.entities, dc.text
+        FROM documents d LEFT JOIN document_contents dc ON dc.document_id = d.id
+    ''')
+    count = 0
+    while True:
+        rows = c.fetchmany(MAX_BATCH_PARAMETERS)
+        if not rows:
+            break
+        c.connection.executemany(
+            "INSERT INTO documents_fts (rowid, title, summary, entities, body) VALUES (?, ?, ?, ?, ?)",
+            [_fts_row(doc_id, title, summary, entities, zlib.decompress(text).decode('utf-8') if text else '')
+             for doc_id, title, summary, entities, text in rows]
+        )
+        count += len(rows)
+    if count:
+        print(f"Indexed {count} existing documents for keyword search.")
+
+def init_db():
+    """Initializes the SQLite database with the required tables."""
+    ensure_schema()
+
     # Hash passwords before inserting
     security = SecurityManager()
     hashed_hr_pass = security.hash_password('hr_pass')
@@ -52,153 +248,504 @@ def init_db():
     hashed_admin_pass = security.hash_password('admin_pass')
     hashed_legal_pass = security.hash_password('legal_pass')
     hashed_marketing_pass = security.hash_password('marketing_pass')
-    
-    # Insert hardcoded users
-    c.execute("INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", 
-              ('hr_user', hashed_hr_pass, 'HR'))
-    c.execute("INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", 
-              ('finance_user', hashed_finance_pass, 'Finance'))
-    c.execute("INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", 
-              ('admin', hashed_admin_pass, 'Admin'))
-    c.execute("INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", 
-              ('legal_user', hashed_legal_pass, 'Legal'))
-    c.execute("INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", 
-              ('marketing_user', hashed_marketing_pass, 'Marketing'))
-    
-    conn.commit()
-    conn.close()
-
-def insert_document(doc_data):
-    """Inserts document metadata into the database."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO documents (filename, filepath, upload_date, uploader, category, title, author, date_extracted, summary, entities)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        doc_data['filename'], doc_data['filepath'], doc_data['upload_date'],
-        doc_data['uploader'], doc_data['category'], doc_data['title'],
-        doc_data['author'], doc_data['date_extracted'], doc_data['summary'],
-        json.dumps(doc_data['entities'])
-    ))
-    doc_id = c.lastrowid
-    conn.commit()
-    conn.close()
-    return doc_id
-
-def get_documents_by_role(role: str):
-    """Retrieves documents based on the user's role."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    if role == 'Admin':
-        c.execute("SELECT * FROM documents")
-    else:
-        # Assuming category names match roles for simplicity
-        c.execute("SELECT * FROM documents WHERE category = ?", (role,))
-    documents = c.fetchall()
-    conn.close()
+
+    with get_connection() as conn:
+        c = conn.cursor()
+
+        # Insert hardcoded users
+        c.execute("INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", 
+                  ('hr_user', hashed_hr_pass, 'HR'))
+        c.execute("INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", 
+                  ('finance_user', hashed_finance_pass, 'Finance'))
+        c.execute("INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", 
+                  ('admin', hashed_admin_pass, 'Admin'))
+        c.execute("INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", 
+                  ('legal_user', hashed_legal_pass, 'Legal'))
+        c.execute("INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", 
+                  ('marketing_user', hashed_marketing_pass, 'Marketing'))
+
+def insert_document(doc_data, text: str = None, content_hash: str = None):
+    """
+    Inserts one document through insert_documents, so its content store,
+    passage and full-text rows are written in the same transaction.
+
+    Returns the new id, or None when content_hash is already stored.
+    """
+    contents = [(text, content_hash)] if text is not None else None
+    return insert_documents([doc_data], contents)[0]
+
+def insert_documents(docs_data, contents=None):
+    """
+    Inserts many documents in a single transaction.
+
+    Args:
+        docs_data: List of document dicts, as for insert_document.
+        contents: Optional list of (text, content_hash) pairs, aligned with
+            docs_data, stored in the content store in the same transaction.
+            A document whose content hash is already stored, or repeated
+            earlier in the batch, is not inserted.
+
+    Returns:
+        The new document ids, in the order of docs_data, with None for
+        documents skipped as duplicates.
+    """
+    if not docs_data:
+        return []
+    with get_connection() as conn:
+        c = conn.cursor()
+        # Take the write lock up front, so the AUTOINCREMENT ids of this batch are
+        # contiguous and no other job or worker can store the same content meanwhile
+        c.execute("BEGIN IMMEDIATE")
+
+        keep = list(range(len(docs_data)))
+        if contents:
+            hashes = [content_hash for _, content_hash in contents]
+            known = set()
+            for start in range(0, len(hashes), MAX_BATCH_PARAMETERS):
+                batch = hashes[start:start + MAX_BATCH_PARAMETERS]
+                placeholders = ', '.join('?' * len(batch))
+                c.execute(f"SELECT content_hash FROM document_contents WHERE content_hash IN ({placeholders})", batch)
+                known.update(row[0] for row in c.fetchall())
+            keep = []
+            for i, content_hash in enumerate(hashes):
+                if content_hash not in known:
+                    known.add(content_hash)
+                    keep.append(i)
+        if not keep:
+            return [None] * len(docs_data)
+
+        c.executemany('''
+            INSERT INTO documents (filename, filepath, upload_date, uploader, category, title, author, date_extracted, summary, entities)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(
+            docs_data[i]['filename'], docs_data[i]['filepath'], docs_data[i]['upload_date'],
+            docs_data[i]['uploader'], docs_data[i]['category'], docs_data[i]['title'],
+            docs_data[i]['author'], docs_data[i]['date_extracted'], docs_data[i]['summary'],
+            json.dumps(docs_data[i]['entities'])
+        ) for i in keep])
+        last_id = c.execute("SELECT last_insert_rowid()").fetchone()[0]
+        new_ids = dict(zip(keep, range(last_id - len(keep) + 1, last_id + 1)))
+
+        if contents:
+            c.executemany('''
+                INSERT OR REPLACE INTO document_contents (document_id, content_hash, text)
+                VALUES (?, ?, ?)
+            ''', [
+                (new_ids[i], contents[i][1], zlib.compress(contents[i][0].encode('utf-8')))
+                for i in keep
+            ])
+            for i in keep:
+                c.executemany("INSERT INTO document_passages (document_id, chunk_no, text) VALUES (?, ?, ?)",
+                              _passage_rows(new_ids[i], contents[i][0]))
+        c.executemany(
+            "INSERT INTO documents_fts (rowid, title, summary, entities, body) VALUES (?, ?, ?, ?, ?)",
+            [_fts_row(new_ids[i], docs_data[i]['title'], docs_data[i]['summary'], docs_data[i]['entities'],
+                      contents[i][0] if contents else '')
+             for i in keep]
+        )
+    return [new_ids.get(i) for i in range(len(docs_data))]
+
+def save_document_content(doc_id: int, text: str, content_hash: str):
+    """Stores the extracted text of a document together with its content hash."""
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            INSERT OR REPLACE INTO document_contents (document_id, content_hash, text)
+            VALUES (?, ?, ?)
+        ''', (doc_id, content_hash, zlib.compress(text.encode('utf-8'))))
+        c.execute("DELETE FROM document_passages WHERE document_id = ?", (doc_id,))
+        c.executemany("INSERT INTO document_passages (document_id, chunk_no, text) VALUES (?, ?, ?)",
+                      _passage_rows(doc_id, text))
+        c.execute("SELECT title, summary, entities FROM documents WHERE id = ?", (doc_id,))
+        row = c.fetchone()
+        if row:
+            c.execute("DELETE FROM documents_fts WHERE rowid = ?", (doc_id,))
+            c.execute("INSERT INTO documents_fts (rowid, title, summary, entities, body) VALUES (?, ?, ?, ?, ?)",
+                      _fts_row(doc_id, row['title'], row['summary'], row['entities'], text))
+
+def _passage_rows(doc_id: int, text: str):
+    """(document_id, chunk_no, original text) rows for the passages the search index embeds."""
+    return ((doc_id, chunk_no, text[start:end]) for chunk_no, start, end, _ in iter_passages(text))
+
+def save_passages(doc_id: int, text: str):
+    """Stores the passages of a document stored before passages were kept."""
+    with get_connection() as conn:
+        conn.execute("DELETE FROM document_passages WHERE document_id = ?", (doc_id,))
+        conn.executemany("INSERT INTO document_passages (document_id, chunk_no, text) VALUES (?, ?, ?)",
+                         _passage_rows(doc_id, text))
+
+def get_passages(keys):
+    """Returns {(document_id, chunk_no): passage text} for the stored ones among the given keys."""
+    keys = list(keys)
+    passages = {}
+    with get_connection() as conn:
+        c = conn.cursor()
+        for start in range(0, len(keys), MAX_BATCH_PARAMETERS // 2):
+            batch = keys[start:start + MAX_BATCH_PARAMETERS // 2]
+            placeholders = ', '.join('(?, ?)' for _ in batch)
+            c.execute(f"""
+                SELECT document_id, chunk_no, text FROM document_passages
+                WHERE (document_id, chunk_no) IN (VALUES {placeholders})
+            """, [value for key in batch for value in key])
+            for doc_id, chunk_no, text in c.fetchall():
+                passages[(doc_id, chunk_no)] = text
+    return passages
+
+def get_document_content(doc_id: int):
+    """Returns (text, content_hash) for a document, or None if nothing is stored."""
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT text, content_hash FROM document_contents WHERE document_id = ?", (doc_id,))
+        row = c.fetchone()
+    if not row:
+        return None
+    return zlib.decompress(row[0]).decode('utf-8'), row[1]
+
+def get_document_contents(doc_ids):
+    """Returns a {document_id: text} mapping for several documents in one pass."""
+    doc_ids = list(doc_ids)
+    contents = {}
+    with get_connection() as conn:
+        c = conn.cursor()
+        for start in range(0, len(doc_ids), MAX_BATCH_PARAMETERS):
+            batch = doc_ids[start:start + MAX_BATCH_PARAMETERS]
+            placeholders = ', '.join('?' * len(batch))
+            c.execute(f"SELECT document_id, text FROM document_contents WHERE document_id IN ({placeholders})", batch)
+            for doc_id, text in c.fetchall():
+                contents[doc_id] = zlib.decompress(text).decode('utf-8')
+    return contents
+
+def get_document_ids_by_content_hashes(content_hashes):
+    """Returns {content_hash: document_id} for the hashes that belong to a stored document."""
+    content_hashes = list(set(content_hashes))
+    found = {}
+    with get_connection() as conn:
+        c = conn.cursor()
+        for start in range(0, len(content_hashes), MAX_BATCH_PARAMETERS):
+            batch = content_hashes[start:start + MAX_BATCH_PARAMETERS]
+            placeholders = ', '.join('?' * len(batch))
+            c.execute(f'''
+                SELECT content_hash, MIN(document_id) FROM document_contents
+                WHERE content_hash IN ({placeholders}) GROUP BY content_hash
+            ''', batch)
+            found.update(c.fetchall())
+    return found
+
+def record_uploads(uploads):
+    """Records uploads as (document_id, uploader, filename, upload_date) tuples."""
+    with get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO document_uploads (document_id, uploader, filename, upload_date) VALUES (?, ?, ?, ?)",
+            uploads
+        )
+
+def get_document_frequencies(terms):
+    """
+    Returns ({term: number of documents containing it}, number of documents
+    counted) for TF-IDF weighting. Unknown terms are left out.
+    """
+    terms = list(terms)
+    frequencies = {}
+    with get_connection() as conn:
+        c = conn.cursor()
+        for start in range(0, len(terms), MAX_BATCH_PARAMETERS):
+            batch = terms[start:start + MAX_BATCH_PARAMETERS]
+            placeholders = ', '.join('?' * len(batch))
+            c.execute(f"SELECT term, document_count FROM term_frequencies WHERE term IN ({placeholders})", batch)
+            frequencies.update(c.fetchall())
+        c.execute("SELECT value FROM corpus_stats WHERE name = 'documents'")
+        row = c.fetchone()
+    return frequencies, row[0] if row else 0
+
+def add_document_frequencies(term_counts, document_count: int):
+    """
+    Adds newly processed documents to the corpus statistics.
+
+    Args:
+        term_counts: {term: number of the new documents containing it}.
+        document_count: Number of new documents.
+    """
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.executemany('''
+            INSERT INTO term_frequencies (term, document_count) VALUES (?, ?)
+            ON CONFLICT(term) DO UPDATE SET document_count = document_count + excluded.document_count
+        ''', term_counts.items())
+        c.execute('''
+            INSERT INTO corpus_stats (name, value) VALUES ('documents', ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        ''', (document_count,))
+
+def fts_query(query: str) -> str:
+    """
+    Turns free text into an FTS5 query: every word is matched as a quoted
+    phrase, so identifiers like INV-2023-001 match as a whole and FTS5
+    operators typed by users are not interpreted. Any word may match; BM25
+    ranks documents matching more (and rarer) words first.
+    """
+    return ' OR '.join('"' + term + '"' for term in FTS_TERM.findall(query))
+
+def search_documents_text(query: str, categories=None, limit: int = 20):
+    """
+    Keyword search over title, summary, entity names and text, ranked by BM25.
+
+    Args:
+        query: Free text, see fts_query.
+        categories: Categories the caller may see, or None for all of them.
+        limit: Maximum number of documents to return.
+
+    Returns:
+        (document_id, snippet) pairs, best match first.
+    """
+    match = fts_query(query)
+    if not match or categories == []:
+        return []
+    sql = '''
+        SELECT documents_fts.rowid, snippet(documents_fts, 3, '', '', '...', 40)
+        FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid
+        WHERE documents_fts MATCH ?
+    '''
+    params = [match]
+    if categories is not None:
+        sql += f" AND d.category IN ({', '.join('?' * len(categories))})"
+        params.extend(categories)
+    # Title, summary and entity matches weigh more than matches in the body
+    sql += " ORDER BY bm25(documents_fts, 4.0, 2.0, 3.0, 1.0) LIMIT ?"
+    params.append(limit)
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute(sql, params)
+        return [(doc_id, snippet) for doc_id, snippet in c.fetchall()]
+
+def get_content_hashes():
+    """Returns a {document_id: content_hash} mapping for every stored document text."""
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT document_id, content_hash FROM document_contents")
+        hashes = dict(c.fetchall())
+    return hashes
+
+def get_documents_by_role(role: str, columns=None):
+    """Retrieves documents based on the user's role, optionally only some columns."""
+    select = _select_columns(columns)
+    with get_connection() as conn:
+        c = conn.cursor()
+        if role == 'Admin':
+            c.execute(f"SELECT {select} FROM documents")
+        else:
+            # Assuming category names match roles for simplicity
+            c.execute(f"SELECT {select} FROM documents WHERE category = ?", (role,))
+        documents = c.fetchall()
     return documents
 
+def list_documents_page(role: str, limit: int = 100, after=None, order_by: str = 'id', columns=None):
+    """
+    Retrieves one page of a role's documents, newest first, using keyset pagination.
+
+    Args:
+        role: The user's role; non-admins only see their own category.
+        limit: Maximum number of rows to return.
+        after: Sort key of the last row of the previous page, as returned by
+            page_key(); None for the first page.
+        order_by: 'id' or 'upload_date'.
+        columns: Optional subset of DOCUMENT_COLUMNS to fetch.
+
+    Returns:
+        The rows of the page. Cost is O(limit) thanks to the category/upload_date indexes.
+    """
+    if order_by not in ('id', 'upload_date'):
+        raise ValueError(f"Cannot order documents by {order_by}")
+    select = _select_columns(columns)
+    if order_by == 'upload_date' and columns is not None and 'upload_date' not in columns:
+        select += ', upload_date'
+
+    conditions, params = [], []
+    if role != 'Admin':
+        conditions.append("category = ?")
+        params.append(role)
+    if after is not None:
+        if order_by == 'id':
+            conditions.append("id < ?")
+            params.append(after)
+        else:
+            conditions.append("(upload_date, id) < (?, ?)")
+            params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    order = "id DESC" if order_by == 'id' else "upload_date DESC, id DESC"
+
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"SELECT {select} FROM documents {where} ORDER BY {order} LIMIT ?", params + [limit])
+        documents = c.fetchall()
+    return documents
+
+def page_key(row, order_by: str = 'id'):
+    """Returns the keyset value of a row, to pass as `after` for the next page."""
+    if order_by == 'id':
+        return row['id']
+    return [row['upload_date'], row['id']]
+
 def get_document_by_id(doc_id: int):
     """Retrieves a single document by its ID."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("SELECT * FROM documents WHERE id = ?", (doc_id,))
-    document = c.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM documents WHERE id = ?", (doc_id,))
+        document = c.fetchone()
     return document
 
+def get_documents_by_ids(doc_ids, columns=None):
+    """
+    Retrieves several documents with a single query.
+
+    Args:
+        doc_ids: Document ids, e.g. in search rank order.
+        columns: Optional subset of DOCUMENT_COLUMNS to fetch; all by default.
+
+    Returns:
+        Rows in the order of doc_ids. Ids that do not exist are skipped.
+    """
+    doc_ids = list(doc_ids)
+    select = _select_columns(columns)
+    rows = {}
+    with get_connection() as conn:
+        c = conn.cursor()
+        for start in range(0, len(doc_ids), MAX_BATCH_PARAMETERS):
+            batch = doc_ids[start:start + MAX_BATCH_PARAMETERS]
+            placeholders = ', '.join('?' * len(batch))
+            c.execute(f"SELECT {select} FROM documents WHERE id IN ({placeholders})", batch)
+            for row in c.fetchall():
+                rows[row['id']] = row
+    return [rows[doc_id] for doc_id in doc_ids if doc_id in rows]
+
 def delete_document(doc_id: int):
     """Deletes a document by its ID."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
-    deleted_rows = c.rowcount
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+        deleted_rows = c.rowcount
     return deleted_rows > 0
 
+# Upload dates that mark a document as broken: missing, or not starting with
+# a real calendar date. Uploads are stamped with datetime.isoformat(), e.g.
+# 2025-09-14T13:44:57.400597, which is valid. SQLite cannot use an index for
+# this, so cleanups walk the table in primary-key ranges instead.
+INVALID_UPLOAD_DATE = """
+    upload_date IS NULL
+    OR upload_date = ''
+    OR upload_date = 'None'
+    OR LENGTH(upload_date) < 10
+    OR date(substr(upload_date, 1, 10)) IS NULL
+    OR upload_date NOT LIKE '%202%'
+"""
+# Documents deleted per transaction, so a large purge never holds the write lock for long
+CLEANUP_CHUNK_ROWS = 1000
+
+def delete_documents_where(condition: str, params=()):
+    """
+    Deletes the documents matching an SQL condition, one primary-key range
+    per transaction. Their content, uploads and full-text rows go with them
+    (see the triggers in ensure_schema).
+
+    Returns (id, filepath) of every deleted document.
+    """
+    with get_connection() as conn:
+        low, high = conn.execute("SELECT MIN(id), MAX(id) FROM documents").fetchone()
+    if low is None:
+        return []
+
+    deleted = []
+    for start in range(low - 1, high, CLEANUP_CHUNK_ROWS):
+        with get_connection() as conn:
+            c = conn.execute(f"""
+                DELETE FROM documents WHERE id > ? AND id <= ? AND ({condition})
+                RETURNING id, filepath
+            """, (start, start + CLEANUP_CHUNK_ROWS, *params))
+            deleted.extend((row['id'], row['filepath']) for row in c.fetchall())
+    return deleted
+
 def cleanup_invalid_documents():
-    """Removes documents with invalid or null upload dates from the database."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    
-    # First, let's see what we have
-    c.execute("SELECT id, filename, upload_date FROM documents")
-    all_docs = c.fetchall()
-    print(f"Found {len(all_docs)} total documents")
-    
-    # Delete documents with null, empty, or invalid upload_date
-    c.execute("""
-        DELETE FROM documents 
-        WHERE upload_date IS NULL 
-        OR upload_date = '' 
-        OR upload_date = 'None'
-        OR upload_date LIKE '%-%-%T%:%:%'
-        OR LENGTH(upload_date) < 10
-        OR upload_date NOT LIKE '%202%'
-    """)
-    
-    deleted_count = c.rowcount
-    conn.commit()
-    
-    # Check remaining documents
-    c.execute("SELECT id, filename, upload_date FROM documents")
-    remaining_docs = c.fetchall()
-    print(f"Remaining {len(remaining_docs)} documents after cleanup")
-    
-    conn.close()
-    
-    print(f"Cleaned up {deleted_count} documents with invalid dates")
-    return deleted_count
+    """
+    Removes documents with invalid or null upload dates from the database.
+
+    Returns (id, filepath) of the deleted documents.
+    """
+    deleted = delete_documents_where(INVALID_UPLOAD_DATE)
+    print(f"Cleaned up {len(deleted)} documents with invalid dates")
+    return deleted
 
 def force_cleanup_all_documents():
-    """Force delete ALL existing documents to start fresh."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    
-    c.execute("SELECT COUNT(*) FROM documents")
-    total_count = c.fetchone()[0]
-    
-    c.execute("DELETE FROM documents")
-    deleted_count = c.rowcount
-    conn.commit()
-    conn.close()
-    
-    print(f"Force deleted all {deleted_count} documents from database")
-    return deleted_count
+    """
+    Force delete ALL existing documents to start fresh.
+
+    Returns (id, filepath) of the deleted documents.
+    """
+    deleted = delete_documents_where('1')
+    print(f"Force deleted all {len(deleted)} documents from database")
+    return deleted
+
+def get_referenced_filepaths(filepaths):
+    """Returns the subset of filepaths that some document still points to."""
+    filepaths = list(filepaths)
+    referenced = set()
+    with get_connection() as conn:
+        c = conn.cursor()
+        for start in range(0, len(filepaths), MAX_BATCH_PARAMETERS):
+            batch = filepaths[start:start + MAX_BATCH_PARAMETERS]
+            placeholders = ', '.join('?' * len(batch))
+            c.execute(f"SELECT DISTINCT filepath FROM documents WHERE filepath IN ({placeholders})", batch)
+            referenced.update(row[0] for row in c.fetchall())
+    return referenced
 
 def log_access(username: str, action: str, doc_id: int = None):
-    """Logs user actions (uploads, views) to the access logs table."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO access_logs (timestamp, action, username, document_id)
-        VALUES (CURRENT_TIMESTAMP, ?, ?, ?)
-    ''', (action, username, doc_id))
-    conn.commit()
-    conn.close()
+    """
+    Logs user actions (uploads, views) to the access logs table. Events are
+    buffered and written in batches shortly after, see access_log.
+    """
+    access_log.log(username, action, doc_id)
 
 def register_user(username: str, password: str, role: str):
     """Registers a new user in the database."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    
-    c.execute("SELECT username FROM users WHERE username = ?", (username,))
-    if c.fetchone():
-        conn.close()
-        return None
-    
-    security = SecurityManager()
-    hashed_password = security.hash_password(password)
-    
-    c.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", 
-              (username, hashed_password, role))
-    conn.commit()
-    conn.close()
-    
+    with get_connection() as conn:
+        c = conn.cursor()
+
+        c.execute("SELECT username FROM users WHERE username = ?", (username,))
+        if c.fetchone():
+            return None
+
+        security = SecurityManager()
+        hashed_password = security.hash_password(password)
+
+        c.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", 
+                  (username, hashed_password, role))
+
     return {"message": "User registered successfully"}
 
+def update_user(username: str, password: str = None, role: str = None):
+    """
+    Changes a user's password and/or role. Bumping credentials_version
+    invalidates their tokens and cached logins in every worker.
+    """
+    security = SecurityManager()
+    changes, params = [], []
+    if password:
+        changes.append("password = ?")
+        params.append(security.hash_password(password))
+    if role:
+        changes.append("role = ?")
+        params.append(role)
+    if not changes:
+        return False
+
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"UPDATE users SET {', '.join(changes)}, credentials_version = credentials_version + 1 WHERE username = ?",
+                  params + [username])
+        updated = c.rowcount > 0
+
+    if updated:
+        security.invalidate_user(username)
+    return updated
+
 def run_cleanup():
     cleanup_invalid_documents()
 
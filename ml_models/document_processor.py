@@ -1,88 +1,381 @@
+import os
 import re
-import docx
+import time
+import hashlib
+import zipfile
+import threading
+import multiprocessing
 import spacy
+import numpy as np
+from scipy import sparse
 from PyPDF2 import PdfReader
-from collections import Counter
-from heapq import nlargest
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from itertools import islice
+from xml.etree import ElementTree
+from .model_registry import registry
 
-# Load spaCy model for entity recognition
-nlp = spacy.load("en_core_web_sm")
+# Only the entity recognizer is used, so the other components are never loaded.
+# In en_core_web_sm the ner component embeds tokens itself; the shared tok2vec
+# only feeds the tagger and parser, so it is excluded too.
+NER_EXCLUDED_PIPES = ["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer", "senter"]
+
+# spaCy model for entity recognition, loaded on first use
+registry.register('spacy', lambda: spacy.load("en_core_web_sm", exclude=NER_EXCLUDED_PIPES))
+
+# Text is tagged in chunks of at most NER_CHUNK_CHARS, well below spaCy's
+# max_length; text after NER_MAX_CHARS is not tagged. Each label keeps its
+# NER_MAX_PER_LABEL most frequent entities.
+NER_CHUNK_CHARS = 50000
+NER_MAX_CHARS = int(os.environ.get('NER_MAX_CHARS', 1000000))
+NER_MAX_PER_LABEL = int(os.environ.get('NER_MAX_PER_LABEL', 25))
+
+# PDFs with at least PARALLEL_MIN_PAGES pages are parsed by EXTRACT_PROCESSES
+# processes in ranges of PAGES_PER_TASK pages. Pages after PDF_MAX_PAGES are
+# skipped, and a PDF taking longer than EXTRACT_TIMEOUT_SECONDS is given up.
+EXTRACT_PROCESSES = int(os.environ.get('EXTRACT_PROCESSES', 4))
+PARALLEL_MIN_PAGES = 40
+PAGES_PER_TASK = 20
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', 2000))
+EXTRACT_TIMEOUT_SECONDS = float(os.environ.get('EXTRACT_TIMEOUT_SECONDS', 300))
+TEXT_BLOCK_CHARS = 1024 * 1024
+
+# Batches of at least this many chunks are tagged by a persistent pool of
+# NER_PROCESSES spawned worker processes, each with its own spaCy model
+NER_PROCESSES = int(os.environ.get('NER_PROCESSES', 2))
+MULTIPROCESS_MIN_DOCS = 32
 
 def extract_text(file_path: str) -> str:
     """Extracts text from various document types."""
+    # Joining once is linear; appending page by page copied the text over and over
+    return ''.join(iter_text(file_path))
+
+def iter_text(file_path: str, max_pages: int = PDF_MAX_PAGES, timeout: float = EXTRACT_TIMEOUT_SECONDS):
+    """
+    Yields the text of a document piece by piece: PDF pages, DOCX paragraphs
+    or blocks of a text file, each ending in a newline where the document
+    has a break. Only the current piece has to be held in memory.
+
+    Args:
+        file_path: Path of a .pdf, .docx or .txt file.
+        max_pages: PDF pages after this are ignored.
+        timeout: Seconds a PDF may take before TimeoutError is raised.
+    """
     if file_path.endswith('.pdf'):
-        reader = PdfReader(file_path)
-        text = ''
-        for page in reader.pages:
-            text += page.extract_text() or ''
-        return text
+        yield from _iter_pdf(file_path, max_pages, timeout)
     elif file_path.endswith('.docx'):
-        doc = docx.Document(file_path)
-        return '\n'.join([para.text for para in doc.paragraphs])
+        yield from _iter_docx(file_path)
     elif file_path.endswith('.txt'):
         with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
-    return ""
+            for block in iter(lambda: f.read(TEXT_BLOCK_CHARS), ''):
+                yield block
+
+def _extract_pdf_pages(file_path: str, start: int, stop: int):
+    """Extracts pages [start, stop) of a PDF; runs in the extraction process pool."""
+    reader = PdfReader(file_path)
+    return [(reader.pages[n].extract_text() or '') + '\n' for n in range(start, stop)]
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+def _get_extract_pool():
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            # Spawned, not forked: the parent runs threads and may hold loaded models
+            _extract_pool = ProcessPoolExecutor(EXTRACT_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+        return _extract_pool
+
+def _iter_pdf(file_path: str, max_pages: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    page_count = min(len(PdfReader(file_path).pages), max_pages)
+
+    if page_count < PARALLEL_MIN_PAGES or EXTRACT_PROCESSES < 2:
+        reader = PdfReader(file_path)
+        for n in range(page_count):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Text extraction took longer than {timeout}s")
+            yield (reader.pages[n].extract_text() or '') + '\n'
+        return
+
+    # Page ranges are parsed in parallel, but only a few ranges are in flight
+    # at a time so finished pages never pile up ahead of the consumer
+    pool = _get_extract_pool()
+    ranges = iter([(start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK)])
+    pending = deque()
+    for start, stop in islice(ranges, EXTRACT_PROCESSES * 2):
+        pending.append(pool.submit(_extract_pdf_pages, file_path, start, stop))
+    try:
+        while pending:
+            pages = pending.popleft().result(timeout=max(0, deadline - time.monotonic()))
+            for start, stop in islice(ranges, 1):
+                pending.append(pool.submit(_extract_pdf_pages, file_path, start, stop))
+            yield from pages
+    except FuturesTimeout:
+        raise TimeoutError(f"Text extraction took longer than {timeout}s")
+    finally:
+        for future in pending:
+            future.cancel()
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+def _iter_docx(file_path: str):
+    """Streams paragraphs out of word/document.xml without building the whole document tree."""
+    with zipfile.ZipFile(file_path) as archive, archive.open('word/document.xml') as xml:
+        for _, element in ElementTree.iterparse(xml, events=('end',)):
+            if element.tag == _W + 'p':
+                parts = []
+                for node in element.iter():
+                    if node.tag == _W + 't':
+                        parts.append(node.text or '')
+                    elif node.tag == _W + 'tab':
+                        parts.append('\t')
+                    elif node.tag in (_W + 'br', _W + 'cr'):
+                        parts.append('\n')
+                yield ''.join(parts) + '\n'
+                element.clear()
+            elif element.tag == _W + 'body':
+                element.clear()
+
+def compute_file_hash(file_path: str) -> str:
+    """Returns the SHA-256 hex digest of a file, read in blocks."""
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+_ner_pool = None
+_ner_pool_lock = threading.Lock()
+
+def _get_ner_pool():
+    global _ner_pool
+    with _ner_pool_lock:
+        if _ner_pool is None:
+            # Spawned once and reused, like the extraction pool; forking from an
+            # ingestion thread would copy a process with live threads and models
+            _ner_pool = ProcessPoolExecutor(NER_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+        return _ner_pool
+
+def _tag_entities(chunks, batch_size: int):
+    """Runs NER over (text, n) chunks, returning (n, label, entity text) triples; also runs in the NER pool."""
+    return [
+        (n, ent.label_, ent.text.strip())
+        for doc, n in registry.get('spacy').pipe(chunks, as_tuples=True, batch_size=batch_size)
+        for ent in doc.ents
+    ]
 
 def extract_metadata(text: str):
     """Extracts title, author, date, and entities using regex and spaCy."""
-    metadata = {
-        'title': 'Untitled',
-        'author': 'Unknown',
-        'date_extracted': 'Unknown',
-        'entities': []
-    }
-    
-    # 1. Title: First bold sentence or line
-    # (Regex is a simple approximation, better with custom logic or font parsing)
-    title_match = re.search(r'^\s*([A-Z][\w\s,]+)\s*\n', text)
-    if title_match:
-        metadata['title'] = title_match.group(1).strip()
-    
-    # 2. Author: Regex for "Author:", "By:", or email
-    author_match = re.search(r'(?:Author|By):\s*([^\n]+)|[\w\.-]+@[\w\.-]+\.\w+', text, re.IGNORECASE)
-    if author_match:
-        metadata['author'] = author_match.group(1) if author_match.group(1) else author_match.group(0)
-    
-    # 3. Date: Regex-based detection
-    date_match = re.search(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\b\d{4}[/-]\d{1,2}[/-]\d{1,2}|\b(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},\s+\d{4}', text)
-    if date_match:
-        metadata['date_extracted'] = date_match.group(0)
-
-    # 4. Entities: Use spaCy
-    doc = nlp(text)
-    entities = {}
-    for ent in doc.ents:
-        if ent.label_ not in entities:
-            entities[ent.label_] = []
-        entities[ent.label_].append(ent.text)
-    metadata['entities'] = entities
-    
-    return metadata
+    return extract_metadata_batch([text])[0]
 
-def summarize_text(text: str, num_sentences: int = 3) -> str:
+def _ner_chunks(text: str):
+    """Splits text into NER_CHUNK_CHARS sized pieces, cutting at line breaks or spaces where possible."""
+    text = text[:NER_MAX_CHARS]
+    start = 0
+    while start < len(text):
+        end = min(start + NER_CHUNK_CHARS, len(text))
+        if end < len(text):
+            cut = text.rfind('\n', start, end)
+            if cut <= start:
+                cut = text.rfind(' ', start, end)
+            if cut > start:
+                end = cut + 1
+        yield text[start:end]
+        start = end
+
+def extract_metadata_batch(texts, batch_size: int = 16, n_process: int = None, max_per_label: int = NER_MAX_PER_LABEL):
     """
-    Extractive summarization using a simple TF-IDF / word frequency approach.
+    Extracts metadata for many documents at once.
+
+    Entities are tagged with spaCy's `pipe`, which batches the documents'
+    chunks through the NER-only pipeline. Large batches are split over the
+    NER process pool.
+
+    Args:
+        texts: List of document texts.
+        batch_size: Number of chunks per spaCy batch.
+        n_process: Number of NER processes; defaults to NER_PROCESSES for
+            batches of at least MULTIPROCESS_MIN_DOCS chunks, else 1.
+        max_per_label: Number of distinct entities kept per label.
+
+    Returns:
+        A list of metadata dicts in the order of texts. Entities are stored
+        as {label: {entity text: occurrences}}.
     """
-    sentences = [sentence.strip() for sentence in re.split(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s', text) if sentence.strip()]
-    
-    # Simple tokenization and frequency counting
-    word_freq = Counter(word.lower() for word in re.findall(r'\b\w+\b', text))
-    
-    # Calculate sentence scores based on word frequency
-    sentence_scores = {}
-    for i, sentence in enumerate(sentences):
-        for word in re.findall(r'\b\w+\b', sentence.lower()):
-            if word in word_freq:
-                if i not in sentence_scores:
-                    sentence_scores[i] = word_freq[word]
-                else:
-                    sentence_scores[i] += word_freq[word]
-    
-    # Get top N sentences based on score
-    top_sentences_indices = nlargest(num_sentences, sentence_scores, key=sentence_scores.get)
+    chunks = [(chunk, n) for n, text in enumerate(texts) for chunk in _ner_chunks(text)]
+    if n_process is None:
+        n_process = NER_PROCESSES if len(chunks) >= MULTIPROCESS_MIN_DOCS else 1
+
+    if n_process > 1:
+        pool = _get_ner_pool()
+        parts = [chunks[i::n_process] for i in range(n_process)]
+        entities = [entity for future in [pool.submit(_tag_entities, part, batch_size) for part in parts if part]
+                    for entity in future.result()]
+    else:
+        entities = _tag_entities(chunks, batch_size)
+
+    counts = [{} for _ in texts]  # per document: label -> Counter of entity texts
+    for n, label, entity in entities:
+        counts[n].setdefault(label, Counter())[entity] += 1
+
+    results = []
+    for text, labels in zip(texts, counts):
+        metadata = {
+            'title': 'Untitled',
+            'author': 'Unknown',
+            'date_extracted': 'Unknown',
+            'entities': {}
+        }
+        
+        # 1. Title: First bold sentence or line
+        # (Regex is a simple approximation, better with custom logic or font parsing)
+        title_match = re.search(r'^\s*([A-Z][\w\s,]+)\s*\n', text)
+        if title_match:
+            metadata['title'] = title_match.group(1).strip()
+        
+        # 2. Author: Regex for "Author:", "By:", or email
+        author_match = re.search(r'(?:Author|By):\s*([^\n]+)|[\w\.-]+@[\w\.-]+\.\w+', text, re.IGNORECASE)
+        if author_match:
+            metadata['author'] = author_match.group(1) if author_match.group(1) else author_match.group(0)
+        
+        # 3. Date: Regex-based detection
+        date_match = re.search(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\b\d{4}[/-]\d{1,2}[/-]\d{1,2}|\b(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},\s+\d{4}', text)
+        if date_match:
+            metadata['date_extracted'] = date_match.group(0)
+
+        # 4. Entities: distinct spaCy entities with their counts, most frequent first
+        metadata['entities'] = {
+            label: dict(counter.most_common(max_per_label))
+            for label, counter in labels.items()
+        }
+        
+        results.append(metadata)
     
+    return results
+
+# Common English words that say nothing about a document's topic
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have having
+he her here hers herself him himself his how i if in into is it its itself just may me might more most
+must my myself no nor not now of off on once only or other our ours ourselves out over own per same shall
+she should so some such than that the their theirs them themselves then there these they this those
+through to too under until up upon us very was we were what when where which while who whom why will with
+within without would you your yours yourself yourselves
+""".split())
+
+SUMMARY_MAX_CHARS = 600
+_SENTENCE_SPLIT_RE = re.compile(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s')
+_TERM_RE = re.compile(r'\b[^\W\d_]{2,}\b')
+
+def _iter_sentences(pieces):
+    """Splits a string or a stream of text pieces into sentences."""
+    if isinstance(pieces, str):
+        pieces = [pieces]
+    carry = ''
+    for piece in pieces:
+        parts = _SENTENCE_SPLIT_RE.split(carry + piece)
+        # The last part may continue in the next piece
+        carry = parts.pop()
+        for sentence in parts:
+            if sentence.strip():
+                yield sentence.strip()
+    if carry.strip():
+        yield carry.strip()
+
+def build_term_matrix(pieces):
+    """
+    Tokenizes a document in one pass.
+
+    Args:
+        pieces: The document text, or an iterable of its pieces (see iter_text).
+
+    Returns:
+        (sentences, terms, matrix): the sentences, the distinct non-stopword
+        terms, and a sparse sentences x terms matrix of term counts.
+    """
+    sentences = []
+    vocabulary = {}
+    rows = []
+    cols = []
+    for sentence in _iter_sentences(pieces):
+        row = len(sentences)
+        sentences.append(sentence)
+        for term in _TERM_RE.findall(sentence.lower()):
+            if term not in STOPWORDS:
+                rows.append(row)
+                cols.append(vocabulary.setdefault(term, len(vocabulary)))
+
+    # Duplicate (row, col) entries are summed into counts
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype='float32'), (rows, cols)),
+        shape=(len(sentences), len(vocabulary))
+    )
+    return sentences, list(vocabulary), matrix
+
+def summarize_sentences(sentences, terms, matrix, document_frequencies=None, corpus_size: int = 0,
+                        num_sentences: int = 3, max_chars: int = SUMMARY_MAX_CHARS) -> str:
+    """
+    Picks the most informative sentences by TF-IDF.
+
+    Each term is weighted by (1 + log of its count in the document) times its
+    inverse document frequency in the corpus; a sentence scores the sum of its
+    distinct terms' weights over the square root of their number, so long
+    sentences are not favoured just for being long.
+
+    Args:
+        sentences, terms, matrix: As returned by build_term_matrix.
+        document_frequencies: {term: number of corpus documents containing it};
+            without it every term gets the same IDF.
+        corpus_size: Number of documents the frequencies were counted over.
+        num_sentences: Maximum number of sentences.
+        max_chars: Length budget of the summary; sentences that do not fit are skipped.
+    """
+    if not sentences or not terms:
+        return ''
+
+    term_counts = np.asarray(matrix.sum(axis=0)).ravel()
+    weights = 1 + np.log(term_counts)
+    if document_frequencies is not None:
+        # Smoothed IDF, counting the current document as part of the corpus
+        df = np.array([document_frequencies.get(term, 0) for term in terms], dtype='float32') + 1
+        weights *= np.log((corpus_size + 2) / (df + 1)) + 1
+
+    presence = (matrix > 0).astype('float32')
+    term_totals = np.asarray(presence.sum(axis=1)).ravel()
+    scores = (presence @ weights) / np.sqrt(np.maximum(term_totals, 1))
+
+    chosen = []
+    length = 0
+    for index in np.argsort(-scores, kind='stable'):
+        if len(chosen) == num_sentences or scores[index] <= 0:
+            break
+        sentence_length = len(sentences[index]) + (1 if chosen else 0)
+        if max_chars and length + sentence_length > max_chars:
+            continue
+        chosen.append(index)
+        length += sentence_length
+
+    if not chosen:
+        # Even the best sentence is over budget, so cut it at a word boundary
+        return sentences[int(np.argmax(scores))][:max_chars].rsplit(' ', 1)[0] + '...'
+
     # Reconstruct the summary in original order
-    top_sentences_indices.sort()
-    
-    return ' '.join([sentences[i] for i in top_sentences_indices])
\ No newline at end of file
+    return ' '.join(sentences[i] for i in sorted(chosen))
+
+def summarize_text(text, num_sentences: int = 3, max_chars: int = SUMMARY_MAX_CHARS,
+                   document_frequencies=None, corpus_size: int = 0) -> str:
+    """
+    Extractive summarization using TF-IDF sentence scores.
+
+    Args:
+        text: The document text, or an iterable of its pieces.
+        num_sentences: Maximum number of sentences.
+        max_chars: Length budget of the summary.
+        document_frequencies, corpus_size: Corpus statistics for IDF, see
+            summarize_sentences.
+    """
+    sentences, terms, matrix = build_term_matrix(text)
+    return summarize_sentences(sentences, terms, matrix, document_frequencies, corpus_size,
+                               num_sentences=num_sentences, max_chars=max_chars)
@@ -0,0 +1,77 @@
+import time
+import faiss
+import numpy as np
+
+from .vector_index import INDEX_TYPES, VectorPartition, build_ann_index, IVF_NPROBE, HNSW_EF_SEARCH
+
+def make_vectors(n: int, dim: int = 384, clusters: int = 1000, seed: int = 0):
+    """
+    Synthetic unit-length vectors around random centers, which is closer to
+    real passage embeddings than uniform noise (and harder for IVF).
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype('float32')
+    vectors = np.empty((n, dim), dtype='float32')
+    for start in range(0, n, 65536):
+        size = min(65536, n - start)
+        vectors[start:start + size] = centers[rng.integers(0, clusters, size)] + \
+            0.5 * rng.standard_normal((size, dim)).astype('float32')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def benchmark(n: int, index_types=INDEX_TYPES, dim: int = 384, queries: int = 200, k: int = 10,
+              nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH):
+    """
+    Measures build time, recall@k against exact search and single-query
+    latency (p50/p99, in milliseconds) of each index type on n vectors.
+    """
+    # Queries come from the same clusters as the indexed vectors
+    vectors = make_vectors(n + queries, dim)
+    vectors, query_vectors = vectors[:n], vectors[n:]
+
+    start = time.perf_counter()
+    exact = faiss.IndexFlatIP(dim)
+    exact.add(vectors)
+    exact_seconds = time.perf_counter() - start
+    _, truth = exact.search(query_vectors, k)
+    ids = np.arange(n, dtype='int64')
+
+    results = []
+    for index_type in index_types:
+        # Searched through a partition, as the engine does (PQ results are re-ranked)
+        partition = VectorPartition(dim, index_type)
+        partition.store.add_with_ids(vectors, ids)
+        if index_type == 'flat':
+            build_seconds = exact_seconds
+        else:
+            start = time.perf_counter()
+            partition.finish_rebuild(build_ann_index(index_type, vectors, nprobe, ef_search), ids, chunk_bits=0)
+            build_seconds = time.perf_counter() - start
+
+        latencies = []
+        found = 0
+        for i in range(queries):
+            start = time.perf_counter()
+            _, labels = partition.search(query_vectors[i:i + 1], k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found += len(np.intersect1d(labels[0], truth[i]))
+
+        results.append({
+            'index_type': index_type,
+            'vectors': n,
+            'build_seconds': round(build_seconds, 2),
+            f'recall@{k}': round(found / (queries * k), 4),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+            'p99_ms': round(float(np.percentile(latencies, 99)), 3)
+        })
+    return results
+
+if __name__ == "__main__":
+    # Compares the index types before choosing SEARCH_INDEX_TYPE, e.g.
+    #   python -m ml_models.index_benchmark 10000 100000 1000000
+    import sys
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    for size in sizes:
+        for row in benchmark(size):
+            print(row)
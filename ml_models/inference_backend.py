@@ -0,0 +1,185 @@
+import os
+import time
+import numpy as np
+from importlib.metadata import version, PackageNotFoundError
+
+# 'torch' runs the fp32 models as published, 'quantized' applies int8 dynamic
+# quantization to their Linear layers and 'onnx' runs an ONNX export through
+# ONNX Runtime (needs the optimum[onnxruntime] package)
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch')
+BACKENDS = ('torch', 'quantized', 'onnx')
+
+# Quantized and exported models are written here once and reused afterwards
+MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', 'data/models')
+
+# Cached models are only valid for the library versions that wrote them
+CACHE_KEY_PACKAGES = ('torch', 'transformers', 'sentence-transformers', 'optimum', 'onnxruntime')
+
+def _library_versions() -> str:
+    versions = []
+    for package in CACHE_KEY_PACKAGES:
+        try:
+            versions.append(f"{package}{version(package)}")
+        except PackageNotFoundError:
+            pass
+    return '-'.join(versions)
+
+def _cache_path(model_name: str, backend: str, cache_dir: str) -> str:
+    name = '-'.join(part for part in (model_name.replace('/', '--'), backend, _library_versions()) if part)
+    return os.path.join(cache_dir, name)
+
+def _quantize(model):
+    """int8 dynamic quantization: weights are stored as int8, activations stay float."""
+    import torch
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def _load_quantized(path: str, build):
+    """
+    Quantizes the model from build() and loads its cached int8 weights from
+    path, or caches them there. Only the state_dict is stored, and it is
+    read with weights_only, so the cache never unpickles arbitrary objects.
+    """
+    import torch
+    path = path + '.pt'
+    model = _quantize(build())
+    if os.path.exists(path):
+        try:
+            model.load_state_dict(torch.load(path, weights_only=True))
+            return model
+        except Exception as e:
+            print(f"Could not load cached quantized weights {path}, quantizing again: {e}")
+            model = _quantize(build())  # a failed load may have replaced some weights
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save(model.state_dict(), tmp_path)
+    os.replace(tmp_path, path)
+    return model
+
+def load_sentence_encoder(model_name: str, backend: str = INFERENCE_BACKEND, cache_dir: str = MODEL_CACHE_DIR):
+    """
+    Loads a SentenceTransformer with the requested inference backend.
+
+    Falls back to the plain torch model when the backend cannot be used.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in BACKENDS:
+        print(f"Unknown inference backend '{backend}', using torch.")
+        backend = 'torch'
+    path = _cache_path(model_name, backend, cache_dir)
+
+    try:
+        if backend == 'quantized':
+            return _load_quantized(path, lambda: SentenceTransformer(model_name, device='cpu'))
+        if backend == 'onnx':
+            if os.path.isdir(path):
+                return SentenceTransformer(path, backend='onnx', device='cpu')
+            model = SentenceTransformer(model_name, backend='onnx', device='cpu')
+            model.save(path)
+            return model
+    except Exception as e:
+        print(f"Could not load {model_name} with the {backend} backend, using torch: {e}")
+    return SentenceTransformer(model_name)
+
+def load_zero_shot_pipeline(model_name: str, backend: str = INFERENCE_BACKEND, cache_dir: str = MODEL_CACHE_DIR):
+    """
+    Builds a zero-shot classification pipeline with the requested inference backend.
+
+    Falls back to the plain torch model when the backend cannot be used.
+    """
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
+
+    if backend not in BACKENDS:
+        print(f"Unknown inference backend '{backend}', using torch.")
+        backend = 'torch'
+    path = _cache_path(model_name, backend, cache_dir)
+
+    try:
+        if backend == 'quantized':
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            model = _load_quantized(path, lambda: AutoModelForSequenceClassification.from_pretrained(model_name))
+            return pipeline("zero-shot-classification", model=model, tokenizer=tokenizer)
+        if backend == 'onnx':
+            from optimum.onnxruntime import ORTModelForSequenceClassification
+            if os.path.isdir(path):
+                model = ORTModelForSequenceClassification.from_pretrained(path)
+                tokenizer = AutoTokenizer.from_pretrained(path)
+            else:
+                model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+                tokenizer = AutoTokenizer.from_pretrained(model_name)
+                model.save_pretrained(path)
+                tokenizer.save_pretrained(path)
+            return pipeline("zero-shot-classification", model=model, tokenizer=tokenizer)
+    except Exception as e:
+        print(f"Could not load {model_name} with the {backend} backend, using torch: {e}")
+    return pipeline("zero-shot-classification", model=model_name)
+
+def check_encoder_parity(reference, candidate, texts):
+    """
+    Compares the embeddings of a candidate encoder against the fp32 reference.
+
+    Returns the minimum and mean cosine similarity per text and the time each
+    encoder took.
+    """
+    start = time.perf_counter()
+    expected = np.asarray(reference.encode(texts), dtype='float32')
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = np.asarray(candidate.encode(texts), dtype='float32')
+    candidate_seconds = time.perf_counter() - start
+
+    cosine = (expected * actual).sum(axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1) + 1e-12)
+    return {
+        'min_cosine': float(cosine.min()),
+        'mean_cosine': float(cosine.mean()),
+        'reference_seconds': reference_seconds,
+        'candidate_seconds': candidate_seconds
+    }
+
+def check_classifier_parity(reference, candidate, texts, labels):
+    """
+    Compares the top labels of a candidate zero-shot pipeline against the
+    fp32 reference.
+
+    Returns the share of texts that get the same label and the time each
+    pipeline took.
+    """
+    start = time.perf_counter()
+    expected = reference(texts, labels)
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = candidate(texts, labels)
+    candidate_seconds = time.perf_counter() - start
+
+    if isinstance(expected, dict):
+        expected, actual = [expected], [actual]
+    agreement = sum(e['labels'][0] == a['labels'][0] for e, a in zip(expected, actual)) / len(texts)
+    return {
+        'label_agreement': agreement,
+        'reference_seconds': reference_seconds,
+        'candidate_seconds': candidate_seconds
+    }
+
+if __name__ == "__main__":
+    # Checks a backend against fp32 before switching to it, e.g.
+    #   python -m ml_models.inference_backend quantized
+    import sys
+    from .search_engine import MODEL_NAME
+    from .classification_model import ZERO_SHOT_MODEL, LABEL_DESCRIPTIONS
+
+    backend = sys.argv[1] if len(sys.argv) > 1 else INFERENCE_BACKEND
+    samples = list(LABEL_DESCRIPTIONS.values()) + [
+        "Please find attached the invoice for March, payable within 30 days.",
+        "The parties agree that this agreement terminates after twelve months.",
+        "Quarterly revenue grew 12% while operating expenses stayed flat."
+    ]
+
+    print(f"Encoder {MODEL_NAME}, {backend} vs torch:")
+    print(check_encoder_parity(load_sentence_encoder(MODEL_NAME, 'torch'), load_sentence_encoder(MODEL_NAME, backend), samples))
+    print(f"Classifier {ZERO_SHOT_MODEL}, {backend} vs torch:")
+    print(check_classifier_parity(
+        load_zero_shot_pipeline(ZERO_SHOT_MODEL, 'torch'),
+        load_zero_shot_pipeline(ZERO_SHOT_MODEL, backend),
+        samples, list(LABEL_DESCRIPTIONS)
+    ))
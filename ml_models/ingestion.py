@@ -0,0 +1,192 @@
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from .connection import get_connection
+
+# Finished and abandoned job records are dropped after this long
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+class QueueFullError(Exception):
+    """Raised when the pipeline cannot accept more work right now."""
+
+class MemoryJobStore:
+    """Job records kept in this process, the newest max_jobs of them."""
+
+    def __init__(self, max_jobs: int = 1000):
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, job: dict):
+        with self._lock:
+            self.jobs[job['id']] = dict(job)
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+
+    def update(self, job_id: str, changes: dict):
+        with self._lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(changes)
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self.jobs.pop(job_id, None)
+
+class SQLiteJobStore:
+    """
+    Job records in the ingestion_jobs table, so any worker process can
+    report on a job another one accepted.
+    """
+
+    COLUMNS = ('id', 'owner', 'status', 'stage', 'progress', 'result', 'error', 'created_at', 'updated_at')
+
+    def create(self, job: dict):
+        with get_connection() as conn:
+            conn.execute("DELETE FROM ingestion_jobs WHERE updated_at < ?", (time.time() - JOB_RETENTION_SECONDS,))
+            conn.execute(f"""
+                INSERT INTO ingestion_jobs ({', '.join(self.COLUMNS)})
+                VALUES ({', '.join('?' * len(self.COLUMNS))})
+            """, [self._encode(column, job.get(column)) for column in self.COLUMNS])
+
+    def update(self, job_id: str, changes: dict):
+        columns = [column for column in changes if column in self.COLUMNS and column != 'id']
+        with get_connection() as conn:
+            conn.execute(
+                f"UPDATE ingestion_jobs SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+                [self._encode(column, changes[column]) for column in columns] + [job_id]
+            )
+
+    def get(self, job_id: str):
+        with get_connection() as conn:
+            row = conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM ingestion_jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def delete(self, job_id: str):
+        with get_connection() as conn:
+            conn.execute("DELETE FROM ingestion_jobs WHERE id = ?", (job_id,))
+
+    @staticmethod
+    def _encode(column, value):
+        return json.dumps(value) if column == 'result' and value is not None else value
+
+class IngestionPipeline:
+    """
+    Runs uploaded documents through a series of processing stages on worker
+    threads, e.g. extract -> metadata/NER -> classify -> summarize -> index.
+
+    Every stage reads from its own bounded queue, so a slow stage blocks the
+    stages in front of it instead of buffering without limit, and submit()
+    refuses new work once the first queue is full.
+    """
+
+    def __init__(self, stages, queue_size: int = 32, job_store=None):
+        """
+        Args:
+            stages: List of (name, function, workers) tuples. Each function
+                takes the job's context dict and adds its outputs to it; the
+                last stage should put the job's response under 'result'.
+                A stage that sets context['done'] finishes the job early.
+            queue_size: Capacity of each stage's input queue.
+            job_store: Where job records for status lookups are kept;
+                MemoryJobStore by default, SQLiteJobStore to share them
+                between worker processes.
+        """
+        self.stages = stages
+        self.job_store = job_store or MemoryJobStore()
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self._threads = []  # worker threads, one list per stage
+
+    def start(self):
+        """Starts the worker threads of every stage."""
+        for index, (name, _, workers) in enumerate(self.stages):
+            threads = []
+            for n in range(workers):
+                thread = threading.Thread(target=self._work, args=(index,), name=f"ingest-{name}-{n}", daemon=True)
+                thread.start()
+                threads.append(thread)
+            self._threads.append(threads)
+
+    def stop(self, timeout: float = 30.0):
+        """Lets queued jobs finish, then stops the workers."""
+        # Stop stage by stage so each one has handed its work on before the next stops
+        for index, threads in enumerate(self._threads):
+            for _ in threads:
+                self._queues[index].put(None)
+            for thread in threads:
+                thread.join(timeout)
+        self._threads = []
+
+    def submit(self, context: dict, owner: str = None) -> str:
+        """
+        Queues a job and returns its id without waiting for any processing.
+
+        Raises:
+            QueueFullError: If the first stage's queue is full.
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'owner': owner,
+            'status': 'queued',
+            'stage': None,
+            'progress': 0.0,
+            'result': None,
+            'error': None,
+            'created_at': time.time(),
+            'updated_at': time.time()
+        }
+        self.job_store.create(job)
+
+        try:
+            self._queues[0].put_nowait((job, context))
+        except queue.Full:
+            self.job_store.delete(job_id)
+            raise QueueFullError("Ingestion queue is full, try again later")
+        return job_id
+
+    def get_job(self, job_id: str):
+        """Returns a snapshot of a job's status, or None if unknown."""
+        return self.job_store.get(job_id)
+
+    def _update(self, job, **changes):
+        changes['updated_at'] = time.time()
+        try:
+            self.job_store.update(job['id'], changes)
+        except Exception as e:
+            # A status write must not lose the document itself
+            print(f"Could not record status of ingestion job {job['id']}: {e}")
+
+    def _work(self, index: int):
+        name, function, _ = self.stages[index]
+        while True:
+            item = self._queues[index].get()
+            if item is None:
+                break
+            job, context = item
+
+            self._update(job, status='processing', stage=name)
+            try:
+                function(context)
+            except Exception as e:
+                print(f"Ingestion job {job['id']} failed in stage {name}: {e}")
+                self._update(job, status='failed', error=f"{name}: {e}")
+                continue
+
+            if index + 1 < len(self.stages) and not context.get('done'):
+                self._update(job, progress=(index + 1) / len(self.stages))
+                # Blocks while the next stage is saturated (backpressure)
+                self._queues[index + 1].put((job, context))
+            else:
+                self._update(job, status='completed', stage=None, progress=1.0, result=context.get('result'))
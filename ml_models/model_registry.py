@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+
+# Comma-separated model names (or 'all') to load when the app is imported.
+# Under `gunicorn --preload` that happens once in the master, and the workers
+# share the loaded weights copy-on-write instead of loading their own.
+PRELOAD_MODELS = os.environ.get('PRELOAD_MODELS', '')
+
+class ModelRegistry:
+    """
+    Loads models on first use instead of at import time.
+
+    Each model is registered with a factory; get() calls it once and keeps
+    the result. Workers that never touch a model never pay for loading it.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._models = {}
+        self._load_seconds = {}
+        self._locks = {}  # one per model, so loading one does not block the others
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory):
+        """Registers a zero-argument function that builds the model."""
+        with self._lock:
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name: str):
+        """Returns the model, loading it on the first call."""
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._locks[name]:
+            if name not in self._models:
+                print(f"Loading model '{name}'...")
+                start = time.perf_counter()
+                self._models[name] = self._factories[name]()
+                self._load_seconds[name] = time.perf_counter() - start
+                print(f"Loaded model '{name}' in {self._load_seconds[name]:.1f}s.")
+            return self._models[name]
+
+    def is_registered(self, name: str) -> bool:
+        return name in self._factories
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def preload(self, names=None):
+        """Loads the given models (all registered ones by default) right away."""
+        for name in names or list(self._factories):
+            self.get(name)
+
+    def status(self) -> dict:
+        """Reports for every registered model whether it is loaded and how long loading took."""
+        return {
+            name: {'loaded': name in self._models, 'load_seconds': self._load_seconds.get(name)}
+            for name in self._factories
+        }
+
+registry = ModelRegistry()
+
+def preload_configured():
+    """Preloads the models named in PRELOAD_MODELS."""
+    if not PRELOAD_MODELS:
+        return
+    names = None if PRELOAD_MODELS == 'all' else [name.strip() for name in PRELOAD_MODELS.split(',') if name.strip()]
+    registry.preload(names)
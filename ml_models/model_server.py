@@ -0,0 +1,291 @@
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Listener, Client
+
+# When set, API workers send inference and search calls to a model server at
+# this address ("host:port" or a Unix socket path) instead of loading models.
+# Start the server with `python -m ml_models.model_server`.
+MODEL_SERVER_ADDRESS = os.environ.get('MODEL_SERVER_ADDRESS', '')
+# The server listens on this Unix socket unless told otherwise, so only local
+# processes can reach it
+DEFAULT_ADDRESS = 'data/model_server.sock'
+# Shared secret for the connection handshake. Messages are unpickled, so
+# anyone holding it can run code in the server; there is no default.
+MODEL_SERVER_AUTHKEY = os.environ.get('MODEL_SERVER_AUTHKEY', '').encode('utf-8')
+
+# Calls arriving within MAX_WAIT_SECONDS of each other are run as one batch
+MAX_BATCH_ITEMS = 64
+MAX_WAIT_SECONDS = 0.01
+
+class ModelServerError(Exception):
+    """Raised when the model server cannot be reached or a remote call fails."""
+
+def require_authkey(authkey: bytes) -> bytes:
+    """Refuses to talk to or serve peers without an explicit shared secret."""
+    if not authkey:
+        raise ModelServerError("MODEL_SERVER_AUTHKEY must be set to use the model server")
+    return authkey
+
+def parse_address(address: str):
+    """Turns "host:port" into a TCP address; anything else is a Unix socket path."""
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+class MicroBatcher:
+    """
+    Collects list-valued calls from many connections and runs them through
+    one function call, so concurrent requests share model batches.
+
+    The function takes a list of items and returns one result per item.
+    """
+
+    def __init__(self, function, max_items: int = MAX_BATCH_ITEMS, max_wait: float = MAX_WAIT_SECONDS):
+        self.function = function
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self._requests = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, items):
+        """Queues items and blocks until their results are ready."""
+        request = {'items': list(items), 'done': threading.Event()}
+        self._requests.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['results']
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            size = len(batch[0]['items'])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_items:
+                try:
+                    request = self._requests.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request['items'])
+
+            items = [item for request in batch for item in request['items']]
+            try:
+                results = self.function(items)
+                start = 0
+                for request in batch:
+                    request['results'] = results[start:start + len(request['items'])]
+                    start += len(request['items'])
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+            for request in batch:
+                request['done'].set()
+
+class ModelServer:
+    """
+    Serves the models and the search index of one process to every API worker.
+
+    Each connection gets a thread. Embedding, classification and NER calls go
+    through MicroBatchers; all other calls go straight to the target object.
+    Calls that change the search index run one at a time.
+    """
+
+    def __init__(self, targets: dict, batchers: dict):
+        """
+        Args:
+            targets: Name -> (object, names of the methods and properties
+                clients may use).
+            batchers: (target, method) -> MicroBatcher for list-valued methods.
+        """
+        self.targets = targets
+        self.batchers = batchers
+        self._write_lock = threading.Lock()
+
+    def serve(self, address: str = DEFAULT_ADDRESS, authkey: bytes = MODEL_SERVER_AUTHKEY):
+        authkey = require_authkey(authkey)
+        address = parse_address(address)
+        if isinstance(address, str) and os.path.exists(address):
+            os.remove(address)  # stale socket of a previous run
+        with Listener(address, authkey=authkey) as listener:
+            if isinstance(address, str):
+                os.chmod(address, 0o600)
+            print(f"Model server listening on {address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"Model server rejected a connection: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _dispatch(self, target, method, args, kwargs):
+        batcher = self.batchers.get((target, method))
+        if batcher is not None and not kwargs:
+            return batcher.submit(args[0])
+
+        obj, allowed = self.targets[target]
+        if method not in allowed:
+            raise AttributeError(f"{target}.{method} is not served")
+        attribute = getattr(obj, method)
+        if not callable(attribute):
+            # Properties; key views are not picklable
+            return set(attribute) if isinstance(attribute, type({}.keys())) else attribute
+        if target == 'search_engine' and method in ('add_document', 'add_documents', 'remove_document',
+                                                     'remove_documents', 'set_category', 'update_document', 'save',
+                                                     'rebuild_indexes'):
+            with self._write_lock:
+                return attribute(*args, **kwargs)
+        return attribute(*args, **kwargs)
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    target, method, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    conn.send(('ok', self._dispatch(target, method, args, kwargs)))
+                except Exception as e:
+                    conn.send(('error', f"{type(e).__name__}: {e}"))
+
+class ModelServerClient:
+    """
+    A thread-safe client for the model server. Keeps one connection per
+    concurrent caller and reconnects after the server restarts.
+    """
+
+    def __init__(self, address: str = MODEL_SERVER_ADDRESS, authkey: bytes = MODEL_SERVER_AUTHKEY):
+        self.address = parse_address(address)
+        self.authkey = require_authkey(authkey)
+        self._idle = queue.LifoQueue()
+
+    def call(self, target: str, method: str, *args, **kwargs):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = Client(self.address, authkey=self.authkey)
+            except OSError as e:
+                raise ModelServerError(f"Model server unavailable: {e}")
+
+        try:
+            conn.send((target, method, args, kwargs))
+            status, result = conn.recv()
+        except (EOFError, OSError) as e:
+            conn.close()
+            raise ModelServerError(f"Lost connection to model server: {e}")
+        self._idle.put(conn)
+
+        if status == 'error':
+            raise ModelServerError(result)
+        return result
+
+    def proxy(self, target: str):
+        return RemoteProxy(self, target)
+
+class RemoteProxy:
+    """Forwards method calls to an object in the model server."""
+
+    def __init__(self, client: ModelServerClient, target: str):
+        self._client = client
+        self._target = target
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._client.call(self._target, name, *args, **kwargs)
+
+class RemoteSearchEngine(RemoteProxy):
+    """SemanticSearchEngine stand-in whose index lives in the model server."""
+
+    def __init__(self, client: ModelServerClient):
+        super().__init__(client, 'search_engine')
+
+    @property
+    def document_ids(self):
+        return self._client.call('search_engine', 'document_ids')
+
+    @property
+    def document_categories(self):
+        return self._client.call('search_engine', 'document_categories')
+
+    @property
+    def embedding_dim(self):
+        return self._client.call('search_engine', 'embedding_dim')
+
+    @property
+    def version(self):
+        return self._client.call('search_engine', 'version')
+
+    def load(self) -> bool:
+        # The server loads the saved index when it starts; reloading it from
+        # here would drop documents other workers added since
+        return True
+
+class RemoteClassifier(RemoteProxy):
+    """DocumentClassifier stand-in that classifies in the model server."""
+
+    def __init__(self, client: ModelServerClient):
+        super().__init__(client, 'classifier')
+
+    def classify_documents(self, texts, embeddings=None):
+        if embeddings is None:
+            embeddings = [None] * len(texts)
+        return self._client.call('classifier', 'classify_pairs', list(zip(texts, embeddings)))
+
+    def classify_document(self, text: str, embedding=None) -> str:
+        return self.classify_documents([text], [embedding])[0]
+
+def build_server(index_dir: str = 'data') -> ModelServer:
+    """Creates the models, loads the saved index and wires up the batched methods."""
+    from . import document_processor
+    from .classification_model import DocumentClassifier
+    from .search_engine import SemanticSearchEngine
+    from .model_registry import registry
+
+    search_engine = SemanticSearchEngine(index_dir=index_dir)
+    classifier = DocumentClassifier()
+    search_engine.load()
+    registry.preload()
+
+    def classify(items):
+        texts = [text for text, _ in items]
+        embeddings = [embedding for _, embedding in items]
+        return classifier.classify_documents(texts, None if any(e is None for e in embeddings) else embeddings)
+
+    return ModelServer(
+        targets={
+            'search_engine': (search_engine, {
+                'document_ids', 'document_categories', 'embedding_dim', 'ntotal', 'is_current',
+                'add_document', 'add_documents', 'remove_document', 'remove_documents', 'set_category',
+                'update_document', 'document_embeddings', 'search', 'save', 'version', 'cache_stats',
+                'rebuild_indexes', 'set_search_params'
+            }),
+            'classifier': (classifier, {'fit_head'}),
+            'document_processor': (document_processor, set()),
+            'registry': (registry, {'status'})
+        },
+        batchers={
+            ('search_engine', 'embed_documents'): MicroBatcher(search_engine.embed_documents),
+            ('classifier', 'classify_pairs'): MicroBatcher(classify),
+            ('document_processor', 'extract_metadata_batch'): MicroBatcher(document_processor.extract_metadata_batch)
+        }
+    )
+
+if __name__ == "__main__":
+    import sys
+    from .connection import DATABASE_FILE
+
+    address = sys.argv[1] if len(sys.argv) > 1 else (MODEL_SERVER_ADDRESS or DEFAULT_ADDRESS)
+    require_authkey(MODEL_SERVER_AUTHKEY)
+    server = build_server(index_dir=os.path.dirname(DATABASE_FILE))
+    server.targets['search_engine'][0].start_autosave()
+    try:
+        server.serve(address)
+    finally:
+        server.targets['search_engine'][0].save()
@@ -1,59 +1,641 @@
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, nothing to serialize with
+    fcntl = None
+from itertools import islice
+from .chunking import iter_passages, batched, PASSAGE_WORDS, PASSAGE_OVERLAP
+from .inference_backend import load_sentence_encoder, INFERENCE_BACKEND
+from .model_registry import registry
+from .cache import TTLCache
+from .vector_index import (VectorPartition, build_ann_index, configure_search, INDEX_TYPE, INDEX_TYPES,
+                           ANN_MIN_VECTORS, IVF_NPROBE, HNSW_EF_SEARCH)
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# Passage vectors are stored under doc_id << CHUNK_BITS | chunk_no, so all
+# passages of one document form a contiguous id range
+CHUNK_BITS = 20
+EMBED_BATCH_SIZE = 64
+
+# Embeddings of recent queries; they only depend on the model, not the index
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 4096))
+QUERY_CACHE_TTL = 3600
+
+# While the index changes, it is saved at most this often (0 only saves on shutdown)
+SAVE_INTERVAL_SECONDS = float(os.environ.get('SEARCH_SAVE_INTERVAL_SECONDS', 60))
+
+def normalize_query(query: str) -> str:
+    """Lowercases and collapses whitespace; the MiniLM tokenizer is uncased anyway."""
+    return ' '.join(query.lower().split())
+
+def reciprocal_rank_fusion(rankings, k: int = 60):
+    """
+    Merges ranked lists of document ids by reciprocal rank fusion: each list
+    adds 1 / (k + rank) for every document it contains.
+
+    Scores are scaled so that a document ranked first by every list gets 1.0.
+    Returns (document_id, score) pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    best = len(rankings) / (k + 1)
+    return sorted(((doc_id, score / best) for doc_id, score in scores.items()), key=lambda item: -item[1])
+
+def chunk_id(doc_id: int, chunk_no: int) -> int:
+    return (doc_id << CHUNK_BITS) | chunk_no
+
+def split_chunk_id(passage_id: int):
+    return passage_id >> CHUNK_BITS, passage_id & ((1 << CHUNK_BITS) - 1)
+
+class ReadWriteLock:
+    """
+    Lets any number of searches read the partitions at once while changes get
+    exclusive access. Used as a context manager it is the exclusive side,
+    reentrant like an RLock; read() is the shared side. Waiting writers hold
+    off new readers, so a steady stream of searches cannot starve ingestion.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._depth = 0
+        self._waiting_writers = 0
+
+    def __enter__(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._depth += 1
+                return self
+            self._waiting_writers += 1
+            while self._writer is not None or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer, self._depth = me, 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._condition:
+            self._depth -= 1
+            if self._depth == 0:
+                self._writer = None
+                self._condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            # The writing thread may read what it already holds exclusively
+            if self._writer != threading.get_ident():
+                while self._writer is not None or self._waiting_writers:
+                    self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
 
 class SemanticSearchEngine:
     """
     Manages semantic search using SentenceTransformers for embeddings
     and FAISS for vector indexing.
+
+    Embeddings are normalized to unit length and scored by inner product, so
+    scores are cosine similarities (higher is better). Large partitions can
+    be searched through an approximate index, see vector_index.
     """
-    
-    def __init__(self):
-        # Load a pre-trained SentenceTransformer model
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.documents = []  # Stores (doc_id, text) tuples
-        self.document_ids = []
-        self.embeddings = None
-        self.index = None
-        
-    def add_document(self, doc_id: int, text: str):
-        """Adds a document to the index."""
-        self.documents.append((doc_id, text))
-        self.document_ids.append(doc_id)
-        
-        # We'll re-index the entire corpus for simplicity
-        self.rebuild_index()
-        
-    def rebuild_index(self):
-        """Generates embeddings and rebuilds the FAISS index."""
-        if not self.documents:
+
+    def __init__(self, index_dir: str = 'data', backend: str = INFERENCE_BACKEND, index_type: str = INDEX_TYPE):
+        # Pre-trained SentenceTransformer model, optionally quantized or as ONNX.
+        # It is only loaded once something needs encoding; a saved index can be
+        # loaded and searched by id without it.
+        registry.register('encoder', lambda: load_sentence_encoder(MODEL_NAME, backend))
+        self._embedding_dim = None
+        self.content_hashes = {}  # doc_id -> hash of the file the vectors were built from
+        self.document_categories = {}  # doc_id -> category, i.e. the partition holding its vectors
+
+        # One index per document category, so a role-restricted search only
+        # scores vectors the caller may see. Passage vectors are stored under
+        # their chunk id, so single documents can be added or removed without
+        # touching the rest of the index.
+        self.partitions = {}
+        if index_type not in INDEX_TYPES:
+            print(f"Unknown search index type '{index_type}', using flat.")
+            index_type = 'flat'
+        self.index_type = index_type
+        self.nprobe = IVF_NPROBE
+        self.ef_search = HNSW_EF_SEARCH
+
+        # Guards the partitions: ingestion workers add documents while requests
+        # search. Searches only share the read side, so they run concurrently
+        # (FAISS searches are thread-safe); every change takes it exclusively.
+        self._lock = ReadWriteLock()
+
+        # Incremented by every change to the indexed documents, so caches of
+        # search results can include it in their keys
+        self.version = 0
+        self._saved_version = 0
+        self.query_cache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+
+        # On-disk copy of the index, kept next to the database
+        self.index_dir = index_dir
+        self.index_path = os.path.join(index_dir, 'search_index.npz')
+        self.lock_path = os.path.join(index_dir, 'search_index.lock')
+        self._save_lock = threading.Lock()
+
+    @property
+    def model(self):
+        return registry.get('encoder')
+
+    @property
+    def embedding_dim(self) -> int:
+        """Vector size, taken from the saved index when there is one, so the model can stay unloaded."""
+        if self._embedding_dim is None:
+            self._embedding_dim = self.model.get_sentence_embedding_dimension()
+        return self._embedding_dim
+
+    def _fingerprint(self, embedding_dim: int) -> str:
+        return f"{MODEL_NAME}:{embedding_dim}:cosine:passages-{PASSAGE_WORDS}-{PASSAGE_OVERLAP}"
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifies the embedding space; vectors from another model are useless."""
+        return self._fingerprint(self.embedding_dim)
+
+    @property
+    def document_ids(self):
+        """Ids of all indexed documents, as a set-like view."""
+        return self.document_categories.keys()
+
+    @property
+    def ntotal(self) -> int:
+        """Total number of passage vectors across all partitions."""
+        return sum(partition.ntotal for partition in self.partitions.values())
+
+    def _partition(self, category):
+        """Returns the partition for a category, creating it on first use."""
+        if category not in self.partitions:
+            self.partitions[category] = VectorPartition(self.embedding_dim, self.index_type)
+        return self.partitions[category]
+
+    def _encode(self, texts):
+        """Encodes a list of texts into a matrix of unit-length float32 vectors for FAISS."""
+        embeddings = self.model.encode(texts, convert_to_tensor=False)
+        embeddings = np.ascontiguousarray(np.asarray(embeddings, dtype='float32').reshape(len(texts), -1))
+        faiss.normalize_L2(embeddings)
+        return embeddings
+
+    def embed_documents(self, texts):
+        """
+        Embeds the passages of several documents in shared batches.
+
+        Returns one (passages, dim) matrix per document, rows in chunk order,
+        which can be reused for classification and passed to add_documents.
+        """
+        def passages():
+            for n, text in enumerate(texts):
+                for _, _, _, passage in islice(iter_passages(text), 1 << CHUNK_BITS):
+                    yield n, passage
+
+        parts = [[] for _ in texts]
+        for batch in batched(passages(), EMBED_BATCH_SIZE):
+            embeddings = self._encode([passage for _, passage in batch])
+            for (n, _), vector in zip(batch, embeddings):
+                parts[n].append(vector)
+        return [np.vstack(p) if p else np.zeros((0, self.embedding_dim), dtype='float32') for p in parts]
+
+    def document_embeddings(self):
+        """
+        Returns (doc_ids, vectors) with one mean passage vector per indexed
+        document, e.g. to train a classifier on past documents.
+        """
+        with self._lock.read():
+            if self.ntotal == 0:
+                return np.zeros(0, dtype='int64'), np.zeros((0, self._embedding_dim or 0), dtype='float32')
+            all_ids, all_vectors = self._all_vectors()
+        doc_ids, inverse = np.unique(np.concatenate(all_ids) >> CHUNK_BITS, return_inverse=True)
+        sums = np.zeros((len(doc_ids), self.embedding_dim), dtype='float32')
+        np.add.at(sums, inverse, all_vectors)
+        counts = np.bincount(inverse, minlength=len(doc_ids)).reshape(-1, 1)
+        return doc_ids, sums / np.maximum(counts, 1)
+
+    def add_document(self, doc_id: int, text, content_hash: str = None, category: str = None):
+        """
+        Splits a document into overlapping passages and adds their embeddings
+        to the live index.
+
+        Args:
+            doc_id: The database id of the document.
+            text: The document text, or an iterable of text fragments as they
+                come out of extraction. Passages are embedded in batches, so
+                memory stays bounded by the batch size, not the document length.
+            content_hash: Hash of the content the vectors are built from.
+            category: The document category, which decides who can find it.
+        """
+        self.add_documents([(doc_id, text, content_hash, category)])
+
+    def add_documents(self, documents, embeddings=None):
+        """
+        Adds several documents, embedding passages of different documents in
+        shared batches so short documents still fill the model's batches.
+
+        Args:
+            documents: Iterable of (doc_id, text, content_hash, category)
+                tuples, with the same meaning as in add_document.
+            embeddings: Optional passage matrices from embed_documents, one
+                per document; when given, nothing is encoded again.
+        """
+        documents = list(documents)
+        with self._lock:
+            for doc_id, _, _, category in documents:
+                self.remove_document(doc_id)
+                self._partition(category)
+                self.document_categories[doc_id] = category
+
+            if embeddings is not None:
+                for (doc_id, _, content_hash, category), vectors in zip(documents, embeddings):
+                    if len(vectors):
+                        ids = np.array([chunk_id(doc_id, n) for n in range(len(vectors))], dtype='int64')
+                        self.partitions[category].add(np.ascontiguousarray(vectors, dtype='float32'), ids, [doc_id])
+                    if content_hash:
+                        self.content_hashes[doc_id] = content_hash
+                self.version += 1
+            self.rebuild_indexes()
             return
-            
-        doc_texts = [doc[1] for doc in self.documents]
-        self.embeddings = self.model.encode(doc_texts, convert_to_tensor=False)
-        
-        # Build FAISS index
-        embedding_dim = self.embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(embedding_dim)  # L2 distance
-        self.index.add(np.array(self.embeddings).astype('float32'))
-    
-    def search(self, query: str, top_k: int = 5):
-        """Performs a semantic search."""
-        if self.index is None:
-            return []
-            
-        query_embedding = self.model.encode(query, convert_to_tensor=False).reshape(1, -1).astype('float32')
-        
-        # Search the index
-        distances, indices = self.index.search(query_embedding, top_k)
-        
-        # Get the document IDs and their relevance scores
+
+        def passages():
+            for doc_id, text, _, category in documents:
+                for chunk_no, _, _, passage in islice(iter_passages(text), 1 << CHUNK_BITS):
+                    yield category, chunk_id(doc_id, chunk_no), passage
+
+        # Encoding happens outside the lock, so searches are not held up by it
+        for batch in batched(passages(), EMBED_BATCH_SIZE):
+            embeddings = self._encode([passage for _, _, passage in batch])
+            categories = [category for category, _, _ in batch]
+            ids = np.array([passage_id for _, passage_id, _ in batch], dtype='int64')
+            with self._lock:
+                for category in set(categories):
+                    mask = np.array([c == category for c in categories])
+                    self.partitions[category].add(np.ascontiguousarray(embeddings[mask]), ids[mask], set((ids[mask] >> CHUNK_BITS).tolist()))
+
+        # Only a fully indexed document counts as current
+        with self._lock:
+            for doc_id, _, content_hash, _ in documents:
+                if content_hash:
+                    self.content_hashes[doc_id] = content_hash
+            self.version += 1
+        self.rebuild_indexes()
+
+    def is_current(self, doc_id: int, content_hash: str) -> bool:
+        """Whether the indexed vectors for doc_id were built from this exact content."""
+        return doc_id in self.document_categories and self.content_hashes.get(doc_id) == content_hash
+
+    def _document_range(self, doc_id: int):
+        return faiss.IDSelectorRange(chunk_id(doc_id, 0), chunk_id(doc_id + 1, 0))
+
+    def remove_document(self, doc_id: int) -> bool:
+        """Removes a document's passages from the index, leaving the others untouched."""
+        with self._lock:
+            if doc_id not in self.document_categories:
+                return False
+
+            category = self.document_categories.pop(doc_id)
+            self.partitions[category].remove(self._document_range(doc_id), doc_id, CHUNK_BITS)
+            self.content_hashes.pop(doc_id, None)
+            self.version += 1
+            return True
+
+    def remove_documents(self, doc_ids) -> int:
+        """
+        Removes several documents with one pass per partition, e.g. after a
+        cleanup. Returns how many of them were indexed.
+        """
+        with self._lock:
+            by_category = {}
+            for doc_id in doc_ids:
+                if doc_id in self.document_categories:
+                    by_category.setdefault(self.document_categories.pop(doc_id), []).append(doc_id)
+                    self.content_hashes.pop(doc_id, None)
+            for category, members in by_category.items():
+                self.partitions[category].remove_documents(members, CHUNK_BITS)
+            removed = sum(len(members) for members in by_category.values())
+            if removed:
+                self.version += 1
+        if removed:
+            # Many dead entries make the approximate index worth rebuilding
+            self.rebuild_indexes()
+        return removed
+
+    def set_category(self, doc_id: int, category: str):
+        """Moves a document's vectors to another category partition without re-embedding."""
+        with self._lock:
+            old_category = self.document_categories.get(doc_id, category)
+            if old_category == category:
+                return
+
+            source = self.partitions[old_category]
+            ids = faiss.vector_to_array(source.store.id_map).astype('int64')
+            ids = ids[(ids >> CHUNK_BITS) == doc_id]
+            if len(ids):
+                vectors = np.vstack([source.store.reconstruct(int(i)) for i in ids]).astype('float32')
+                source.remove(self._document_range(doc_id), doc_id, CHUNK_BITS)
+                self._partition(category).add(vectors, ids, [doc_id])
+            self.document_categories[doc_id] = category
+            self.version += 1
+
+    def update_document(self, doc_id: int, text, content_hash: str = None, category: str = None):
+        """Re-embeds a document whose text has changed."""
+        self.remove_document(doc_id)
+        self.add_document(doc_id, text, content_hash, category)
+
+    def save(self):
+        """
+        Writes vectors, the id mapping, trained approximate indexes and the
+        model fingerprint to disk, unless nothing changed since the last save.
+
+        Everything goes into one .npz file, written under a unique temporary
+        name and swapped in with a single rename while holding a file lock, so
+        workers saving at the same time never mix their files.
+        """
+        with self._lock.read():
+            if self._embedding_dim is None or self.version == self._saved_version:
+                # Nothing was ever loaded or embedded (the model is not worth loading
+                # for that), or the file on disk is already up to date
+                return
+            version = self.version
+
+            # Each partition is saved with its own ids, so loading needs no
+            # reordering; trained approximate indexes are saved too, so a
+            # restart does not rebuild them
+            arrays = {}
+            partitions = []
+            for key, (category, partition) in enumerate(self.partitions.items()):
+                arrays[f'ids_{key}'], arrays[f'vectors_{key}'] = partition.all_vectors()
+                entry = {'category': category, 'key': key, 'count': partition.ntotal, 'ann': None}
+                if partition.ann is not None and partition.touched is None:
+                    arrays[f'index_{key}'] = faiss.serialize_index(partition.ann)
+                    arrays[f'labels_{key}'] = partition.labels.copy()
+                    arrays[f'alive_{key}'] = partition.alive.copy()
+                    entry['ann'] = {'trained_size': partition.trained_size}
+                partitions.append(entry)
+
+            meta = {
+                'fingerprint': self.fingerprint,
+                'dim': self.embedding_dim,
+                'count': self.ntotal,
+                'content_hashes': {str(doc_id): h for doc_id, h in self.content_hashes.items()},
+                'categories': {str(doc_id): c for doc_id, c in self.document_categories.items()},
+                'index_type': self.index_type,
+                'partitions': partitions
+            }
+
+        # Written outside the engine lock, so searches and ingestion go on meanwhile
+        with self._save_lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            fd, tmp_path = tempfile.mkstemp(prefix='search_index.', suffix='.tmp.npz', dir=self.index_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+                os.replace(tmp_path, self.index_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        with self._lock:
+            self._saved_version = max(self._saved_version, version)
+
+    def start_autosave(self, interval: float = SAVE_INTERVAL_SECONDS):
+        """
+        Saves the index every interval seconds while it changes, so a crash
+        only loses what was indexed since then instead of everything since boot.
+        """
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.save()
+                except Exception as e:
+                    print(f"Could not save search index: {e}")
+
+        if interval > 0:
+            threading.Thread(target=run, daemon=True).start()
+
+    def load(self) -> bool:
+        """
+        Loads a previously saved index without re-embedding anything.
+
+        Returns False when there is nothing usable on disk, e.g. the file
+        is missing or was written by a different embedding model.
+        """
+        with self._lock:
+            loaded = self._load()
+        if loaded:
+            # Partitions without a usable saved approximate index get one now
+            self.rebuild_indexes()
+        return loaded
+
+    def _load(self) -> bool:
+        """
+        Reads the saved index into fresh partitions; call with the lock held.
+
+        The vectors end up in RAM, in the partitions' flat stores. They are
+        read one partition at a time, so loading needs at most one partition
+        more than the index itself.
+        """
+        if not os.path.exists(self.index_path):
+            return False
+
+        try:
+            with np.load(self.index_path) as saved:
+                meta = json.loads(str(saved['meta']))
+                embedding_dim = self._embedding_dim or meta.get('dim', 0)
+                if meta.get('fingerprint') != self._fingerprint(embedding_dim):
+                    print("Saved search index was built with a different model, ignoring it.")
+                    return False
+
+                partitions = {}
+                for entry in meta['partitions']:
+                    key = entry['key']
+                    ids, vectors = saved[f'ids_{key}'], saved[f'vectors_{key}']
+                    if vectors.shape != (entry['count'], embedding_dim) or ids.shape != (entry['count'],):
+                        print("Saved search index is inconsistent, ignoring it.")
+                        return False
+                    partition = VectorPartition(embedding_dim, self.index_type)
+                    if len(ids):
+                        partition.add(np.ascontiguousarray(vectors, dtype='float32'), ids.astype('int64'), [])
+                    if entry.get('ann') and meta.get('index_type') == self.index_type:
+                        self._load_ann(partition, saved, key, entry['ann'])
+                    partitions[entry['category']] = partition
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Could not read saved search index: {e}")
+            return False
+        if sum(partition.ntotal for partition in partitions.values()) != meta['count']:
+            print("Saved search index is inconsistent, ignoring it.")
+            return False
+
+        self._embedding_dim = embedding_dim
+        self.partitions = partitions
+        self.content_hashes = {int(doc_id): h for doc_id, h in meta.get('content_hashes', {}).items()}
+        # Documents without any passage (e.g. empty files) only appear in the metadata
+        self.document_categories = {int(doc_id): c for doc_id, c in meta.get('categories', {}).items()}
+        for category in set(self.document_categories.values()):
+            self._partition(category)
+        self.version += 1
+        self._saved_version = self.version
+        return True
+
+    def _load_ann(self, partition, saved, key: int, ann_meta: dict):
+        """Restores a saved approximate index; the partition keeps none if it cannot be read."""
+        try:
+            partition.ann = faiss.deserialize_index(saved[f'index_{key}'])
+            partition.labels = saved[f'labels_{key}']
+            partition.alive = saved[f'alive_{key}']
+            partition.trained_size = ann_meta['trained_size']
+            configure_search(partition.ann, self.nprobe, self.ef_search)
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            print(f"Could not read saved approximate index, rebuilding it: {e}")
+            partition.ann = None
+            partition.labels = np.zeros(0, dtype='int64')
+            partition.alive = np.zeros(0, dtype=bool)
+
+    def _all_vectors(self):
+        """Returns (ids, vectors) of all stored passages, across partitions."""
+        all_ids = [np.zeros(0, dtype='int64')]
+        all_vectors = [np.zeros((0, self.embedding_dim), dtype='float32')]
+        for partition in self.partitions.values():
+            if partition.ntotal:
+                ids, vectors = partition.all_vectors()
+                all_ids.append(ids)
+                all_vectors.append(vectors)
+        return np.concatenate(all_ids), np.vstack(all_vectors)
+
+    def rebuild_indexes(self, force: bool = False):
+        """
+        Builds, retrains or drops the approximate index of every partition
+        that needs it (see VectorPartition.needs_rebuild), or of all of them
+        with force. Building runs outside the lock; searches keep using the
+        previous index until the new one is swapped in.
+        """
+        if self.index_type == 'flat':
+            return
+        with self._lock:
+            todo = [(category, partition) for category, partition in self.partitions.items()
+                    if partition.needs_rebuild() or (force and partition.touched is None)]
+
+        for category, partition in todo:
+            with self._lock:
+                if self.partitions.get(category) is not partition or partition.touched is not None:
+                    continue
+                ids, vectors = partition.begin_rebuild()
+
+            ann = None
+            try:
+                if len(ids) >= ANN_MIN_VECTORS:
+                    print(f"Building {self.index_type} index for {len(ids)} passages in category {category}...")
+                    ann = build_ann_index(self.index_type, vectors, self.nprobe, self.ef_search)
+            except Exception as e:
+                print(f"Could not build {self.index_type} index for category {category}: {e}")
+                with self._lock:
+                    partition.touched = None
+                continue
+
+            with self._lock:
+                partition.finish_rebuild(ann, ids, CHUNK_BITS)
+                self.version += 1
+
+    def set_search_params(self, nprobe: int = None, ef_search: int = None):
+        """Changes the recall/speed trade-off of the approximate indexes."""
+        with self._lock:
+            self.nprobe = nprobe or self.nprobe
+            self.ef_search = ef_search or self.ef_search
+            for partition in self.partitions.values():
+                if partition.ann is not None:
+                    configure_search(partition.ann, self.nprobe, self.ef_search)
+
+    def _encode_query(self, query: str):
+        """Encodes a search query, reusing the embedding of an earlier identical query."""
+        key = normalize_query(query)
+        embedding = self.query_cache.get(key)
+        if embedding is None:
+            embedding = self._encode([key])
+            self.query_cache.set(key, embedding)
+        return embedding
+
+    def cache_stats(self) -> dict:
+        return self.query_cache.stats()
+
+    def _search_partition(self, partition, query_embedding, top_k: int):
+        """Returns {doc_id: (score, chunk_no)} for the best documents in one partition."""
+        if partition.ntotal == 0:
+            return {}
+
+        # Several passages of one document can fill the top hits, so fetch
+        # more passages than documents and widen until top_k documents are found
+        limit = partition.max_candidates
+        k = min(top_k * 4, limit)
+        while True:
+            scores, labels = partition.search(query_embedding, k)
+            best = {}
+            for score, passage_id in zip(scores[0], labels[0]):
+                if passage_id < 0:
+                    continue
+                doc_id, chunk_no = split_chunk_id(int(passage_id))
+                if doc_id not in best:  # hits come sorted, the first one is the best
+                    best[doc_id] = (float(score), chunk_no)
+            if len(best) >= top_k or k >= limit:
+                return best
+            k = min(k * 4, limit)
+
+    def search(self, query: str, top_k: int = 5, categories=None):
+        """
+        Performs a semantic search over passages and returns the best
+        matching documents.
+
+        Args:
+            query: The search text.
+            top_k: Number of documents to return.
+            categories: Only search documents in these categories; None
+                searches everything. Documents outside them are never scored.
+
+        Each result carries the document id, the cosine similarity of its best
+        passage (higher is better) and that passage's chunk number for snippets.
+        """
+        with self._lock.read():
+            if categories is None:
+                partitions = list(self.partitions.values())
+            else:
+                partitions = [self.partitions[c] for c in categories if c in self.partitions]
+            if not any(partition.ntotal for partition in partitions):
+                return []
+
+        query_embedding = self._encode_query(query)
+
+        best = {}
+        with self._lock.read():
+            for partition in partitions:
+                best.update(self._search_partition(partition, query_embedding, top_k))
+        ranked = sorted(best.items(), key=lambda item: -item[1][0])[:top_k]
+
         results = []
-        for i, doc_index in enumerate(indices[0]):
-            if doc_index >= 0 and doc_index < len(self.document_ids):
-                results.append({
-                    'document_id': self.document_ids[doc_index],
-                    'score': float(distances[0][i])
-                })
-        
-        return results
\ No newline at end of file
+        for doc_id, (score, chunk_no) in ranked:
+            results.append({
+                'document_id': doc_id,
+                'score': score,
+                'chunk_no': chunk_no
+            })
+
+        return results
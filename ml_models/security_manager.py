@@ -1,9 +1,70 @@
-import sqlite3
+import os
+import time
+import json
+import hmac
+import base64
+import hashlib
+import secrets
 from passlib.context import CryptContext
+from .cache import TTLCache
+from .connection import DATABASE_FILE, get_connection
 
 # Create a password context for hashing and verification
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Signing key generated on first start when DOCUMENT_API_SECRET is not set.
+# It is stored next to the database, so every worker and restart shares it.
+SECRET_KEY_FILE = os.path.join(os.path.dirname(DATABASE_FILE), 'secret_key')
+
+def _load_secret_key() -> bytes:
+    """Returns DOCUMENT_API_SECRET, or the stored key, creating it if needed."""
+    secret = os.environ.get('DOCUMENT_API_SECRET')
+    if secret:
+        return secret.encode('utf-8')
+    os.makedirs(os.path.dirname(SECRET_KEY_FILE) or '.', exist_ok=True)
+    try:
+        # O_EXCL: when workers start together, exactly one of them writes the key
+        fd = os.open(SECRET_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_urlsafe(32))
+    except FileExistsError:
+        pass
+    for _ in range(50):
+        with open(SECRET_KEY_FILE) as f:
+            secret = f.read().strip()
+        if secret:
+            return secret.encode('utf-8')
+        time.sleep(0.1)  # another worker is still writing it
+    raise RuntimeError(f"{SECRET_KEY_FILE} is empty; delete it or set DOCUMENT_API_SECRET")
+
+_secret_key = None
+
+def signing_key() -> bytes:
+    """
+    The token signing key, loaded on first use. Loading it at import time would
+    create data/ before the app's startup checks whether to seed the database.
+    """
+    global _secret_key
+    if _secret_key is None:
+        _secret_key = _load_secret_key()
+    return _secret_key
+
+TOKEN_TTL_SECONDS = int(os.environ.get('DOCUMENT_API_TOKEN_TTL', 3600))
+
+# Recently verified credentials, so the legacy username/password path does not
+# run bcrypt on every request. Entries remember the user's credentials_version
+# and only count while it is unchanged, so a password or role change made
+# through any worker invalidates them everywhere.
+_credential_cache = TTLCache(maxsize=1024, ttl=300)
+# The cache is per process, so its keys only need a per-process secret
+_CACHE_KEY_SECRET = secrets.token_bytes(32)
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
 class SecurityManager:
     """
     Handles user authentication and role-based access control using hashed passwords.
@@ -17,20 +78,80 @@ class SecurityManager:
         """Verifies a plaintext password against a hashed one."""
         return pwd_context.verify(plain_password, hashed_password)
 
+    def _credentials(self, username):
+        """The user's row: password hash, role and credentials_version (bumped on every change)."""
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT password, role, credentials_version FROM users WHERE username = ?", (username,))
+            return c.fetchone()
+
     def authenticate(self, username, password):
         """Authenticates a user against the database with hashed passwords."""
-        conn = sqlite3.connect('data/documents.db')
-        c = conn.cursor()
-        c.execute("SELECT password, role FROM users WHERE username = ?", (username,))
-        user = c.fetchone()
-        conn.close()
-        
-        if user and self.verify_password(password, user[0]):
-            return {'username': username, 'role': user[1]}
+        user = self._credentials(username)
+        if not user:
+            return None
+
+        # The cache key never contains the plaintext password
+        cache_key = (username, hmac.new(_CACHE_KEY_SECRET, password.encode('utf-8'), hashlib.sha256).hexdigest())
+        if _credential_cache.get(cache_key) == user['credentials_version']:
+            return {'username': username, 'role': user['role'], 'version': user['credentials_version']}
+
+        if self.verify_password(password, user['password']):
+            _credential_cache.set(cache_key, user['credentials_version'])
+            return {'username': username, 'role': user['role'], 'version': user['credentials_version']}
         return None
 
+    def invalidate_user(self, username):
+        """
+        Forgets this process's cached credentials after a password or role change.
+        Other workers notice the bumped credentials_version on their next check.
+        """
+        _credential_cache.discard_where(lambda key: key[0] == username)
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters of the credential cache."""
+        return _credential_cache.stats()
+
+    def create_token(self, user) -> str:
+        """Issues a signed token carrying the user's name, role and expiry."""
+        now = time.time()
+        payload = _b64encode(json.dumps({
+            'sub': user['username'],
+            'role': user['role'],
+            'ver': user['version'],
+            'iat': now,
+            'exp': now + TOKEN_TTL_SECONDS
+        }).encode('utf-8'))
+        signature = _b64encode(hmac.new(signing_key(), payload.encode('ascii'), hashlib.sha256).digest())
+        return f"{payload}.{signature}"
+
+    def verify_token(self, token):
+        """Returns the user for a valid, unexpired token, otherwise None."""
+        try:
+            payload, signature = token.split('.')
+            expected = hmac.new(signing_key(), payload.encode('ascii'), hashlib.sha256).digest()
+            if not hmac.compare_digest(_b64decode(signature), expected):
+                return None
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, UnicodeError):
+            return None
+
+        if claims['exp'] < time.time():
+            return None
+        # Tokens issued before a password or role change are no longer valid
+        user = self._credentials(claims['sub'])
+        if not user or user['credentials_version'] != claims.get('ver'):
+            return None
+        return {'username': claims['sub'], 'role': user['role'], 'version': user['credentials_version']}
+
+    def accessible_categories(self, user_role):
+        """Returns the document categories a role may see, or None for all of them."""
+        if user_role == 'Admin':
+            return None
+        return [user_role]
+
     def has_access(self, user_role, document_category):
         """Checks if a user has access to a document category."""
         if user_role == 'Admin':
             return True
-        return user_role == document_category
\ No newline at end of file
+        return user_role == document_category
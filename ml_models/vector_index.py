@@ -0,0 +1,205 @@
+import os
+import faiss
+import numpy as np
+
+# Search structure built on top of the exact vectors of each partition:
+# 'flat' scans everything (exact), 'ivf_flat' and 'ivf_pq' probe the nearest
+# clusters of an inverted file (PQ also compresses the vectors), 'hnsw' walks
+# a proximity graph. Vectors are unit length and scored by inner product,
+# i.e. cosine similarity, higher is better.
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+INDEX_TYPE = os.environ.get('SEARCH_INDEX_TYPE', 'flat')
+
+# Below this many vectors a partition is scanned exactly; it is fast enough
+# and too small to train clusters on
+ANN_MIN_VECTORS = int(os.environ.get('ANN_MIN_VECTORS', 10000))
+IVF_NPROBE = int(os.environ.get('IVF_NPROBE', 16))
+PQ_SUBQUANTIZERS = int(os.environ.get('PQ_SUBQUANTIZERS', 48))
+HNSW_M = int(os.environ.get('HNSW_M', 32))
+HNSW_EF_CONSTRUCTION = int(os.environ.get('HNSW_EF_CONSTRUCTION', 80))
+HNSW_EF_SEARCH = int(os.environ.get('HNSW_EF_SEARCH', 64))
+
+# An IVF index is retrained once its partition has grown by this factor, and
+# any ANN index is rebuilt once this share of its entries has been deleted
+RETRAIN_GROWTH = 2.0
+MAX_DEAD_FRACTION = 0.2
+# Approximate indexes never return more candidates than this per search
+MAX_CANDIDATES = 4096
+TRAINING_POINTS_PER_LIST = 64
+MAX_TRAINING_POINTS = 100000
+# PQ scores are coarse; this many times more candidates are fetched and
+# re-scored against the exact vectors
+PQ_RERANK_FACTOR = 4
+
+def ivf_lists(n: int) -> int:
+    """
+    Number of IVF clusters for n vectors: the usual 4 * sqrt(n), but with
+    at least the 39 training points per cluster k-means asks for.
+    """
+    return int(min(65536, n // 39, max(16, 4 * np.sqrt(n))))
+
+def _subquantizers(dim: int) -> int:
+    """The largest divisor of dim that is at most PQ_SUBQUANTIZERS."""
+    return max(m for m in range(1, min(PQ_SUBQUANTIZERS, dim) + 1) if dim % m == 0)
+
+def build_ann_index(index_type: str, vectors, nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH):
+    """
+    Builds (and for IVF trains) an approximate index over unit-length vectors.
+
+    Vectors are added in order, so search results are positions in `vectors`.
+    """
+    n, dim = vectors.shape
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif index_type in ('ivf_flat', 'ivf_pq'):
+        nlist = ivf_lists(n)
+        description = f"IVF{nlist},Flat" if index_type == 'ivf_flat' else f"IVF{nlist},PQ{_subquantizers(dim)}x8"
+        index = faiss.index_factory(dim, description, faiss.METRIC_INNER_PRODUCT)
+        sample_size = min(n, nlist * TRAINING_POINTS_PER_LIST, MAX_TRAINING_POINTS)
+        sample = vectors[np.random.default_rng(0).choice(n, sample_size, replace=False)] if sample_size < n else vectors
+        index.train(np.ascontiguousarray(sample, dtype='float32'))
+    else:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+    for start in range(0, n, 65536):
+        index.add(np.ascontiguousarray(vectors[start:start + 65536], dtype='float32'))
+    configure_search(index, nprobe, ef_search)
+    return index
+
+def configure_search(index, nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH):
+    """Sets the speed/recall knobs: IVF clusters probed, or the HNSW candidate list size."""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+    else:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+
+class VectorPartition:
+    """
+    The vectors of one category partition.
+
+    The exact vectors are always kept in a flat store under their passage ids;
+    it is searched directly for 'flat' and small partitions, and is the source
+    for saving, moving documents and (re)building the approximate index.
+    The approximate index refers to vectors by position; deleted positions are
+    only marked dead until the next rebuild. Callers hold the engine's lock.
+    """
+
+    def __init__(self, dim: int, index_type: str = INDEX_TYPE):
+        self.dim = dim
+        self.index_type = index_type
+        self.store = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.ann = None
+        self.labels = np.zeros(0, dtype='int64')  # ann position -> passage id
+        self.alive = np.zeros(0, dtype=bool)
+        self.trained_size = 0
+        self.touched = None  # doc ids changed while a rebuild is running
+
+    @property
+    def ntotal(self) -> int:
+        return self.store.ntotal
+
+    def all_vectors(self):
+        """Returns (ids, vectors) of every stored passage."""
+        if self.store.ntotal == 0:
+            return np.zeros(0, dtype='int64'), np.zeros((0, self.dim), dtype='float32')
+        ids = faiss.vector_to_array(self.store.id_map).astype('int64')
+        return ids, self.store.index.reconstruct_n(0, self.store.ntotal)
+
+    def add(self, vectors, ids, doc_ids):
+        self.store.add_with_ids(vectors, ids)
+        if self.ann is not None:
+            self.ann.add(vectors)
+            self.labels = np.concatenate([self.labels, ids])
+            self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+        if self.touched is not None:
+            self.touched.update(doc_ids)
+
+    def remove(self, selector, doc_id: int, chunk_bits: int):
+        self.store.remove_ids(selector)
+        if self.ann is not None:
+            self.alive[(self.labels >> chunk_bits) == doc_id] = False
+        if self.touched is not None:
+            self.touched.add(doc_id)
+
+    def remove_documents(self, doc_ids, chunk_bits: int):
+        """Removes the passages of several documents in one pass over the store."""
+        doc_ids = np.array(sorted(doc_ids), dtype='int64')
+        ids = faiss.vector_to_array(self.store.id_map).astype('int64')
+        doomed = ids[np.isin(ids >> chunk_bits, doc_ids)]
+        if len(doomed):
+            self.store.remove_ids(doomed)
+        if self.ann is not None:
+            self.alive[np.isin(self.labels >> chunk_bits, doc_ids)] = False
+        if self.touched is not None:
+            self.touched.update(doc_ids.tolist())
+
+    def search(self, query, k: int):
+        """Returns (scores, passage ids) like faiss, with -1 for empty or deleted slots."""
+        if self.ann is None:
+            return self.store.search(query, k)
+        rerank = self.index_type == 'ivf_pq'
+        scores, positions = self.ann.search(query, k * PQ_RERANK_FACTOR if rerank else k)
+        ids = np.where(positions >= 0, self.labels[np.maximum(positions, 0)], -1)
+        ids[(positions >= 0) & ~self.alive[np.maximum(positions, 0)]] = -1
+        if rerank:
+            scores, ids = self._rerank(query, ids, k)
+        return scores, ids
+
+    def _rerank(self, query, ids, k: int):
+        """Re-scores candidate passages with their exact vectors and keeps the best k."""
+        candidates = ids[0][ids[0] >= 0]
+        scores = np.full((1, k), -np.inf, dtype='float32')
+        ranked = np.full((1, k), -1, dtype='int64')
+        if len(candidates):
+            vectors = np.vstack([self.store.reconstruct(int(i)) for i in candidates])
+            exact = vectors @ query[0]
+            order = np.argsort(-exact)[:k]
+            scores[0, :len(order)] = exact[order]
+            ranked[0, :len(order)] = candidates[order]
+        return scores, ranked
+
+    @property
+    def max_candidates(self) -> int:
+        return self.store.ntotal if self.ann is None else min(self.store.ntotal, MAX_CANDIDATES)
+
+    def needs_rebuild(self) -> bool:
+        if self.index_type == 'flat' or self.touched is not None:
+            return False
+        if self.store.ntotal < ANN_MIN_VECTORS:
+            return self.ann is not None  # shrunk below the threshold, back to exact search
+        if self.ann is None:
+            return True
+        dead = len(self.alive) - int(self.alive.sum())
+        if dead > MAX_DEAD_FRACTION * len(self.alive):
+            return True
+        return self.index_type != 'hnsw' and self.store.ntotal > RETRAIN_GROWTH * self.trained_size
+
+    def begin_rebuild(self):
+        """Snapshots the vectors to build from; call with the lock held."""
+        self.touched = set()
+        return self.all_vectors()
+
+    def finish_rebuild(self, ann, ids, chunk_bits: int):
+        """
+        Installs an index built from a begin_rebuild() snapshot, bringing it up
+        to date with documents changed in the meantime; call with the lock held.
+        """
+        touched, self.touched = self.touched, None
+        if ann is None:
+            self.ann, self.labels, self.alive, self.trained_size = None, np.zeros(0, dtype='int64'), np.zeros(0, dtype=bool), 0
+            return
+
+        labels = ids
+        alive = np.ones(len(ids), dtype=bool)
+        if touched:
+            touched_ids = np.array(sorted(touched), dtype='int64')
+            alive[np.isin(labels >> chunk_bits, touched_ids)] = False
+            current_ids, _ = self.all_vectors()
+            current_ids = current_ids[np.isin(current_ids >> chunk_bits, touched_ids)]
+            if len(current_ids):
+                vectors = np.vstack([self.store.reconstruct(int(i)) for i in current_ids]).astype('float32')
+                ann.add(vectors)
+                labels = np.concatenate([labels, current_ids])
+                alive = np.concatenate([alive, np.ones(len(current_ids), dtype=bool)])
+        self.ann, self.labels, self.alive, self.trained_size = ann, labels, alive, len(ids)